@@ -0,0 +1,118 @@
+# checkpointer.py
+
+import asyncio
+import gzip
+import os
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, List, Optional, Tuple
+
+import aiosqlite
+from langgraph.checkpoint.serde.base import SerializerProtocol
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+# WAL lets checkpoint reads proceed alongside the per-node writes; NORMAL sync is durable under WAL.
+SQLITE_PRAGMAS = """
+PRAGMA journal_mode=WAL;
+PRAGMA synchronous=NORMAL;
+PRAGMA temp_store=MEMORY;
+PRAGMA cache_size=-20000;
+PRAGMA busy_timeout=5000;
+PRAGMA mmap_size=268435456;
+"""
+
+READER_PRAGMAS = SQLITE_PRAGMAS + "PRAGMA query_only=1;\n"
+
+# Read-only connections in the checkpoint pool; override with the CHECKPOINT_READERS environment variable.
+# A few suffice: each read is short, and every connection holds its own page cache and mmap.
+CHECKPOINT_READERS = int(os.environ.get("CHECKPOINT_READERS", 4))
+
+# Payloads smaller than this are stored as-is; gzip overhead outweighs the savings.
+GZIP_MIN_BYTES = 1024
+GZIP_TYPE_PREFIX = "gzip+"
+
+
+class GzipSerializer(SerializerProtocol):
+    """Wraps another serializer and gzips (level 1) large checkpoint payloads.
+
+    Compressed payloads are tagged through the type string, so checkpoints written before compression
+    was enabled still load.
+    """
+
+    def __init__(self, inner: Optional[SerializerProtocol] = None):
+        self.inner = inner or JsonPlusSerializer()
+
+    def dumps(self, obj: Any) -> bytes:
+        return self.inner.dumps(obj)
+
+    def loads(self, data: bytes) -> Any:
+        return self.inner.loads(data)
+
+    def dumps_typed(self, obj: Any) -> Tuple[str, bytes]:
+        type_, data = self.inner.dumps_typed(obj)
+        if len(data) < GZIP_MIN_BYTES:
+            return type_, data
+        return GZIP_TYPE_PREFIX + type_, gzip.compress(data, compresslevel=1)
+
+    def loads_typed(self, data: Tuple[str, bytes]) -> Any:
+        type_, payload = data
+        if type_.startswith(GZIP_TYPE_PREFIX):
+            return self.inner.loads_typed((type_[len(GZIP_TYPE_PREFIX):], gzip.decompress(payload)))
+        return self.inner.loads_typed(data)
+
+
+class DualPoolSqliteSaver(AsyncSqliteSaver):
+    """AsyncSqliteSaver with one writer connection and a pool of read-only connections.
+
+    aput / aput_writes stay on the inherited writer connection. aget_tuple / alist borrow a reader
+    from the pool, so state reads are not serialized behind the writer's lock.
+    """
+
+    def __init__(self, conn: aiosqlite.Connection, readers: List[AsyncSqliteSaver], **kwargs):
+        super().__init__(conn, **kwargs)
+        self._readers: asyncio.Queue = asyncio.Queue()
+        for reader in readers:
+            self._readers.put_nowait(reader)
+
+    @classmethod
+    @asynccontextmanager
+    async def from_conn_string(cls, conn_string: str, num_readers: Optional[int] = None) -> AsyncIterator["DualPoolSqliteSaver"]:
+        """Open the writer and reader connections for conn_string and close them on exit.
+
+        num_readers defaults to CHECKPOINT_READERS.
+        """
+        num_readers = max(1, num_readers or CHECKPOINT_READERS)
+        async with aiosqlite.connect(conn_string) as writer_conn:
+            await writer_conn.executescript(SQLITE_PRAGMAS)
+            saver = cls(writer_conn, [], serde=GzipSerializer())
+            # Create the tables before any query_only reader touches them.
+            await saver.setup()
+
+            reader_conns = []
+            try:
+                for _ in range(num_readers):
+                    reader_conn = await aiosqlite.connect(conn_string)
+                    reader_conns.append(reader_conn)
+                    await reader_conn.executescript(READER_PRAGMAS)
+                    reader = AsyncSqliteSaver(reader_conn, serde=saver.serde)
+                    reader.is_setup = True
+                    saver._readers.put_nowait(reader)
+                yield saver
+            finally:
+                for reader_conn in reader_conns:
+                    await reader_conn.close()
+
+    async def aget_tuple(self, config):
+        reader = await self._readers.get()
+        try:
+            return await reader.aget_tuple(config)
+        finally:
+            self._readers.put_nowait(reader)
+
+    async def alist(self, config, *, filter=None, before=None, limit=None):
+        reader = await self._readers.get()
+        try:
+            async for checkpoint_tuple in reader.alist(config, filter=filter, before=before, limit=limit):
+                yield checkpoint_tuple
+        finally:
+            self._readers.put_nowait(reader)
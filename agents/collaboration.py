@@ -1,8 +1,12 @@
 from langchain_core.messages import HumanMessage, SystemMessage, AIMessage
 from langchain_core.language_models.chat_models import BaseChatModel
 from .state import AgentState
+from .llm_gate import gated_astream, response_token_sink
 from typing import Dict, Any, List
 import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
 
 class CollaborationSystem:
     def __init__(self, ir_agent, ti_agent, prevention_agent, llm_map: Dict[str, BaseChatModel]):
@@ -16,16 +20,11 @@ class CollaborationSystem:
     async def multi_agent_consultation_async(self, state: AgentState) -> AgentState:
         """Execute multi-agent collaboration based on collaboration mode"""
 
-        print("\n🤝 Collaboration Process:")
-        print("-" * 40)
+        logger.debug("Collaboration process started")
 
-        current_query = ""
-        for msg in reversed(state["messages"]):
-            if isinstance(msg, HumanMessage):
-                current_query = msg.content
-                break
+        current_query = next((msg.content for msg in reversed(state["messages"]) if isinstance(msg, HumanMessage)), "")
 
-        print(f"Processing query: {current_query}")
+        logger.debug("Processing query: %s", current_query)
 
         collaboration_mode = state.get("collaboration_mode")
         if not collaboration_mode:
@@ -34,72 +33,44 @@ class CollaborationSystem:
         primary_agent = state.get("primary_agent")
         
         llm_choice = state.get("llm_choice", "openai_mini")
-        self.llm = self.llm_map.get(llm_choice, self.llm_map["openai_mini"])
+        llm = self.llm_map.get(llm_choice, self.llm_map["openai_mini"])
 
-        print("\nCollaboration Strategy:")
-        print(f"  - Mode: {collaboration_mode}")
-        print(f"  - Primary Agent: {primary_agent if primary_agent else 'None'}")
-        print(f"  - Collaboration System LLM: {llm_choice}")
+        logger.debug("Collaboration strategy: mode=%s primary_agent=%s llm=%s", collaboration_mode, primary_agent, llm_choice)
 
         agent_responses: Dict[str, str] = {}
         consulting_agents: List[str] = []
 
         if collaboration_mode == "multi_perspective":
-            print("  - Executing Multi-Perspective Collaboration")
-            tasks = []
-            for agent_name, agent_instance in self.agents.items():
-                print(f"    - Consulting {agent_name}...")
-                consulting_agents.append(agent_name)
-                consult_state = AgentState(messages=[HumanMessage(content=current_query)],
-                                          llm_choice=llm_choice,
-                                          agent_type=None, retrieved_docs=[], confidence_score=0.0,
-                                          conversation_summary="", collaboration_mode="", consulting_agents=[],
-                                          agent_responses={}, needs_collaboration=False, primary_agent=None,
-                                          collaboration_confidence=None, thought_process=[], needs_web_search=False,
-                                          thread_id=state.get("thread_id")
-                                          )
-                tasks.append(agent_instance.process_async(consult_state))
-            
-            consultation_results = await asyncio.gather(*tasks)
-            for res in consultation_results:
-                agent_name = res["agent_type"]
-                response_content = ""
-                for msg in reversed(res["messages"]):
-                    if isinstance(msg, AIMessage):
-                        response_content = msg.content
-                        break
-                agent_responses[agent_name] = response_content
+            consulting_agents = list(self.agents)
+            logger.debug("Executing multi-perspective collaboration with %s", consulting_agents)
+
+            agent_responses = await self._consult_agents_async({
+                agent_name: self._build_sub_state(current_query, state)
+                for agent_name in consulting_agents
+            })
+            for agent_name in agent_responses:
                 state["thought_process"].append(f"Multi-perspective: {agent_name} provided insights.")
 
-            final_response = await self._synthesize_multi_perspective_response_async(current_query, agent_responses)
+            final_response = await self._synthesize_multi_perspective_response_async(current_query, agent_responses, llm)
             state["collaboration_confidence"] = self._calculate_collaboration_confidence(agent_responses)
 
 
         elif collaboration_mode == "consultation" and primary_agent:
-            print(f"  - Executing Consultation Mode with {primary_agent} as primary")
+            logger.debug("Executing consultation mode with %s as primary", primary_agent)
             consulting_agents = [name for name in self.agents if name != primary_agent]
 
-            print(f"    - Getting initial response from {primary_agent}...")
-            primary_state = AgentState(messages=[HumanMessage(content=current_query)],
-                                       llm_choice=llm_choice,
-                                       agent_type=None, retrieved_docs=[], confidence_score=0.0,
-                                       conversation_summary="", collaboration_mode="", consulting_agents=[],
-                                       agent_responses={}, needs_collaboration=False, primary_agent=None,
-                                       collaboration_confidence=None, thought_process=[], needs_web_search=False,
-                                       thread_id=state.get("thread_id")
-                                       )
-            primary_response_state = await self.agents[primary_agent].process_async(primary_state)
-            primary_response_content = ""
-            for msg in reversed(primary_response_state["messages"]):
-                if isinstance(msg, AIMessage):
-                    primary_response_content = msg.content
-                    break
+            primary_responses = await self._consult_agents_async({
+                primary_agent: self._build_sub_state(current_query, state)
+            })
+            if primary_agent not in primary_responses:
+                raise RuntimeError(f"Primary agent '{primary_agent}' failed to produce a response.")
+            primary_response_content = primary_responses[primary_agent]
             agent_responses[primary_agent] = primary_response_content
             state["thought_process"].append(f"Consultation: {primary_agent} provided initial response.")
 
-            consultation_tasks = []
+            consult_states = {}
             for agent_name in consulting_agents:
-                print(f"    - {agent_name} consulting on {primary_agent}'s response...")
+                logger.debug("%s consulting on %s's response", agent_name, primary_agent)
                 consultation_prompt = f"""Review the following initial response from the {primary_agent} agent:
 
 Initial Response:
@@ -107,28 +78,14 @@ Initial Response:
 
 Your task as a {agent_name} specialist is to provide additional insights, confirm, or raise concerns regarding this response based on your expertise. Focus on adding value from your unique perspective.
 """
-                consult_state = AgentState(messages=[HumanMessage(content=consultation_prompt)],
-                                           llm_choice=llm_choice,
-                                           agent_type=None, retrieved_docs=[], confidence_score=0.0,
-                                           conversation_summary="", collaboration_mode="", consulting_agents=[],
-                                           agent_responses={}, needs_collaboration=False, primary_agent=None,
-                                           collaboration_confidence=None, thought_process=[], needs_web_search=False,
-                                           thread_id=state.get("thread_id")
-                                           )
-                consultation_tasks.append(self.agents[agent_name].process_async(consult_state))
-            
-            consultation_results = await asyncio.gather(*consultation_tasks)
-            for res in consultation_results:
-                agent_name = res["agent_type"]
-                response_content = ""
-                for msg in reversed(res["messages"]):
-                    if isinstance(msg, AIMessage):
-                        response_content = msg.content
-                        break
+                consult_states[agent_name] = self._build_sub_state(consultation_prompt, state)
+
+            consultation_responses = await self._consult_agents_async(consult_states)
+            for agent_name, response_content in consultation_responses.items():
                 agent_responses[agent_name] = response_content
                 state["thought_process"].append(f"Consultation: {agent_name} provided consultation on primary response.")
 
-            final_response = await self._get_enhanced_primary_response_async(primary_agent, current_query, agent_responses)
+            final_response = await self._get_enhanced_primary_response_async(primary_agent, current_query, agent_responses, llm)
             state["collaboration_confidence"] = self._calculate_collaboration_confidence(agent_responses)
 
         else:
@@ -139,14 +96,46 @@ Your task as a {agent_name} specialist is to provide additional insights, confir
         state["consulting_agents"] = consulting_agents
         state["needs_collaboration"] = False
         
-        print("\nCollaboration Process Complete.")
-        print("-" * 40)
+        logger.debug("Collaboration process complete")
         return state
 
-    async def _synthesize_multi_perspective_response_async(self, query: str, perspectives: Dict[str, str]) -> str:
+    def _build_sub_state(self, query: str, state: AgentState) -> AgentState:
+        """Build a fresh single-agent state for one consulted agent, isolated from the parent state."""
+        return AgentState(messages=[HumanMessage(content=query)],
+                          llm_choice=state.get("llm_choice", "openai_mini"),
+                          agent_type=None, retrieved_doc_ids=[], confidence_score=0.0,
+                          conversation_summary="", collaboration_mode="", consulting_agents=[],
+                          agent_responses={}, needs_collaboration=False, primary_agent=None,
+                          collaboration_confidence=None, thought_process=[], needs_web_search=False,
+                          thread_id=state.get("thread_id")
+                          )
+
+    async def _consult_agents_async(self, sub_states: Dict[str, AgentState]) -> Dict[str, str]:
+        """Run the named agents concurrently and return each agent's final response.
+
+        An agent that raises is logged and left out, so one failing specialist does not sink the whole team.
+        """
+        # Intermediate answers are not streamed; only the team's final response reaches the user live.
+        sink_token = response_token_sink.set(None)
+        try:
+            results = await asyncio.gather(*(
+                self.agents[agent_name].process_async(sub_state)
+                for agent_name, sub_state in sub_states.items()
+            ), return_exceptions=True)
+        finally:
+            response_token_sink.reset(sink_token)
+
+        responses: Dict[str, str] = {}
+        for agent_name, res in zip(sub_states, results):
+            if isinstance(res, Exception):
+                logger.warning("Agent %s failed during collaboration: %s", agent_name, res)
+                continue
+            responses[agent_name] = next((msg.content for msg in reversed(res["messages"]) if isinstance(msg, AIMessage)), "")
+        return responses
+
+    async def _synthesize_multi_perspective_response_async(self, query: str, perspectives: Dict[str, str], llm: BaseChatModel) -> str:
         """Synthesize a final response from multiple agent perspectives."""
-        print("\nSynthesizing Multi-Perspective Response:")
-        print("-" * 40)
+        logger.debug("Synthesizing multi-perspective response")
         synthesis_prompt_content = f"""You are a master cybersecurity synthesizer. Your task is to integrate the following multiple agent perspectives into a single, comprehensive, and cohesive response to the user's original query.
 
 Original User Query:
@@ -160,18 +149,14 @@ Agent Perspectives:
         synthesis_prompt_content += """
 Provide a unified response that leverages insights from all relevant perspectives. Maintain a professional, informative, and actionable tone. Format the response using markdown for better readability. Use headings, lists, and bold text where appropriate. Ensure all key aspects of the original query are addressed comprehensively.
 """
-        synthesis_response = await self.llm.ainvoke([HumanMessage(content=synthesis_prompt_content)])
+        synthesis_response = await gated_astream(llm, [HumanMessage(content=synthesis_prompt_content)])
         final_response = synthesis_response.content
 
-        print("  - Synthesis complete")
-        print("-" * 40)
         return final_response
 
-    async def _get_enhanced_primary_response_async(self, primary_agent: str, query: str, consultation: Dict[str, str]) -> str:
+    async def _get_enhanced_primary_response_async(self, primary_agent: str, query: str, consultation: Dict[str, str], llm: BaseChatModel) -> str:
         """Get enhanced response from primary agent with consultation"""
-        print("\nEnhancing Primary Response:")
-        print("-" * 40)
-        print(f"  - Primary Agent: {primary_agent}")
+        logger.debug("Enhancing primary response from %s", primary_agent)
 
         enhancement_prompt = f"""You are the lead {primary_agent.replace('_', ' ').title()} agent.
 Your task is to provide a comprehensive and actionable response to the original user query, incorporating insights and feedback from the consulting agents.
@@ -193,11 +178,9 @@ Consulting Agent Feedback:
         enhancement_prompt += """
 Provide a final, enhanced response that addresses the user's query thoroughly, integrating relevant points from the consultations. Format the response using markdown for better readability. Use headings, lists, and bold text where appropriate.
 """
-        enhanced_response = await self.llm.ainvoke([HumanMessage(content=enhancement_prompt)])
+        enhanced_response = await gated_astream(llm, [HumanMessage(content=enhancement_prompt)])
         final_response = enhanced_response.content
 
-        print("  - Enhancement complete")
-        print("-" * 40)
         return final_response
 
     def _calculate_collaboration_confidence(self, agent_responses: Dict[str, str]) -> float:
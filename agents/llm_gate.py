@@ -0,0 +1,117 @@
+import asyncio
+import time
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Tuple
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+
+from utils.tokens import count_tokens
+
+# Upper bound on in-flight requests per chat model client. Bursts beyond this queue locally
+# instead of tripping provider rate limits (429s and their retries).
+MAX_CONCURRENT_LLM_CALLS = 8
+
+# Per-client request and prompt-token budgets, paced proactively with token buckets.
+LLM_REQUESTS_PER_MINUTE = 3000
+LLM_TOKENS_PER_MINUTE = 1_000_000
+
+_llm_gates: Dict[int, asyncio.Semaphore] = {}
+
+# Receives the final answer's text as it is generated. Set per query by the caller; None disables streaming.
+response_token_sink: ContextVar[Optional[Callable[[str], None]]] = ContextVar("response_token_sink", default=None)
+
+
+class _TokenBucket:
+    """Async token bucket refilled continuously at per_minute / 60 units per second."""
+
+    def __init__(self, per_minute: int):
+        self.capacity = per_minute
+        self._fill_rate = per_minute / 60.0
+        self._available = float(per_minute)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, amount: int = 1) -> None:
+        """Wait until amount units are available and take them. Waiters are served in arrival order."""
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._available = min(self.capacity, self._available + (now - self._updated) * self._fill_rate)
+                self._updated = now
+                if self._available >= amount:
+                    self._available -= amount
+                    return
+                await asyncio.sleep((amount - self._available) / self._fill_rate)
+
+
+_llm_rate_limits: Dict[int, Tuple[_TokenBucket, _TokenBucket]] = {}
+
+
+def _gate_for(llm: BaseChatModel) -> asyncio.Semaphore:
+    """Return the semaphore shared by every call to this LLM client."""
+    gate = _llm_gates.get(id(llm))
+    if gate is None:
+        gate = _llm_gates[id(llm)] = asyncio.Semaphore(MAX_CONCURRENT_LLM_CALLS)
+    return gate
+
+
+def _rate_limits_for(llm: BaseChatModel) -> Tuple[_TokenBucket, _TokenBucket]:
+    """Return the (requests, tokens) buckets shared by every call to this LLM client."""
+    limits = _llm_rate_limits.get(id(llm))
+    if limits is None:
+        limits = _llm_rate_limits[id(llm)] = (
+            _TokenBucket(LLM_REQUESTS_PER_MINUTE),
+            _TokenBucket(LLM_TOKENS_PER_MINUTE),
+        )
+    return limits
+
+
+async def _acquire_rate_budget(llm: BaseChatModel, messages: List[BaseMessage]) -> None:
+    """Wait until this client's request and prompt-token budgets allow another call."""
+    request_bucket, token_bucket = _rate_limits_for(llm)
+    await request_bucket.acquire()
+    await token_bucket.acquire(sum(count_tokens(str(message.content)) for message in messages))
+
+
+async def gated_ainvoke(llm: BaseChatModel, messages: List[BaseMessage]) -> BaseMessage:
+    """Invoke the LLM once its rate budget allows and a concurrency slot for that client is free."""
+    await _acquire_rate_budget(llm, messages)
+    async with _gate_for(llm):
+        return await llm.ainvoke(messages)
+
+
+def _chunk_text(content) -> str:
+    """Text of a streamed chunk: a plain string, or the text blocks of list-of-blocks content."""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "".join(
+            block if isinstance(block, str) else block.get("text", "")
+            for block in content
+            if isinstance(block, str) or (isinstance(block, dict) and block.get("type") == "text")
+        )
+    return ""
+
+
+async def gated_astream(llm: BaseChatModel, messages: List[BaseMessage]) -> BaseMessage:
+    """Like gated_ainvoke, but forwards text to response_token_sink as it streams in.
+
+    Falls back to a plain invoke when no sink is set or the stream yields nothing. Returns the complete
+    message either way.
+    """
+    sink = response_token_sink.get()
+    if sink is None:
+        return await gated_ainvoke(llm, messages)
+
+    await _acquire_rate_budget(llm, messages)
+    async with _gate_for(llm):
+        response = None
+        async for chunk in llm.astream(messages):
+            text = _chunk_text(chunk.content)
+            if text:
+                sink(text)
+            response = chunk if response is None else response + chunk
+    if response is None:
+        return await gated_ainvoke(llm, messages)
+    return response
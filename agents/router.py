@@ -1,64 +1,134 @@
 from langchain_core.messages import HumanMessage, SystemMessage, BaseMessage, AIMessage
 from langchain_core.language_models.chat_models import BaseChatModel
 from .state import AgentState
+from .llm_gate import gated_ainvoke
 import json
+import logging
+import re
+from collections import OrderedDict
 from typing import Dict
 
+logger = logging.getLogger(__name__)
+
+# Number of distinct normalized queries whose routing decision is remembered.
+ROUTE_CACHE_SIZE = 1024
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+_ROUTING_PROMPT = SystemMessage(
+    content="""You are a cybersecurity routing agent. Your task is to determine which specialist agent 
+    (incident_response, threat_intelligence, prevention) is best suited to answer the user's query.
+    Consider the intent and keywords of the query carefully.
+    
+    Return ONLY the name of the agent (e.g., "incident_response", "threat_intelligence", "prevention").
+    Do NOT include any other text or explanation."""
+)
+
+
+def _normalize_query(query: str) -> str:
+    """Lowercase and collapse whitespace so trivially different phrasings share a cache entry."""
+    return _WHITESPACE_RE.sub(" ", query).strip().lower()
+
+
+def detect_collaboration_need(query: str) -> Dict[str, any]:
+    """Keyword-based check for whether a query needs several agents. Cheap enough to call outside the router node."""
+    query_lower = query.lower()
+
+    agent_type_indicators = {
+        "incident_response": ["incident", "breach", "attack", "compromise", "response", "remediation", "containment", "recovery"],
+        "threat_intelligence": ["threat", "actor", "campaign", "ioc", "ttp", "vulnerability", "exploit", "malware", "ransomware", "advisory", "report"],
+        "prevention": ["prevent", "security", "framework", "policy", "best practice", "control", "guideline", "architecture", "design", "mitigation"]
+    }
+
+    mentioned_types = sum(
+        1 for indicators in agent_type_indicators.values()
+        if any(indicator in query_lower for indicator in indicators)
+    )
+
+    if mentioned_types > 1:
+        return {"mode": "multi_perspective", "needs_collaboration": True}
+
+    high_stakes_indicators = [
+        "critical", "severe", "serious", "major", "significant",
+        "important", "crucial", "vital", "essential", "key",
+        "sensitive", "confidential", "private", "restricted",
+        "emergency", "urgent", "immediate", "priority", "high-priority",
+        "high-risk", "high-value", "high-impact", "high-stakes"
+    ]
+
+    if any(word in query_lower for word in high_stakes_indicators):
+        return {"mode": "consultation", "needs_collaboration": True}
+
+    return {"mode": "single_agent", "needs_collaboration": False}
+
+
 class RouterAgent:
     def __init__(self, llm_map: Dict[str, BaseChatModel], router_llm_key: str = "openai_mini"):
         self.llm = llm_map.get(router_llm_key, llm_map["openai_mini"])
+        self._route_cache: "OrderedDict[str, str]" = OrderedDict()
 
-    async def router_query(self, state: AgentState) -> AgentState:
-        """Determine which specialist agent should handle the query."""
+    async def router_query(self, state: AgentState) -> Dict:
+        """Determine which specialist agent should handle the query.
+
+        Returns only the keys the router decides, so the node can run alongside conversation summarization.
+        """
         current_query_message = state["messages"][-1]
         query_content = current_query_message.content if isinstance(current_query_message, HumanMessage) else ""
 
-        print("\n🤔 Router Analysis:")
-        print("-" * 40)
+        updates = {}
 
         collaboration_info = await self._detect_collaboration_need(query_content)
-        state["collaboration_mode"] = collaboration_info.get("mode")
-        state["needs_collaboration"] = collaboration_info.get("needs_collaboration")
+        updates["collaboration_mode"] = collaboration_info.get("mode")
+        updates["needs_collaboration"] = collaboration_info.get("needs_collaboration")
 
-        print("Collaboration Detection:")
-        print(f"  - Mode: {collaboration_info.get('mode')}")
-        print(f"  - Needs Collaboration: {collaboration_info.get('needs_collaboration')}")
+        logger.debug("Collaboration detection: mode=%s needs_collaboration=%s",
+                     collaboration_info.get("mode"), collaboration_info.get("needs_collaboration"))
 
         all_messages = state["messages"]
         is_follow_up = await self._detect_follow_up(query_content, all_messages[:-1])
-        state["is_follow_up"] = is_follow_up
 
-        print(f"Follow-up Detection: {is_follow_up}")
+        logger.debug("Follow-up detection: %s", is_follow_up)
+        updates["is_follow_up"] = is_follow_up
 
         preferred_agent_type = state.get("preferred_agent")
-        if preferred_agent_type and not state.get("is_follow_up"):
-            print(f"  - Preferred Agent (from state): {preferred_agent_type}")
-            state["agent_type"] = preferred_agent_type
-            return state
-
-        routing_prompt = SystemMessage(
-            content="""You are a cybersecurity routing agent. Your task is to determine which specialist agent 
-            (incident_response, threat_intelligence, prevention) is best suited to answer the user's query.
-            Consider the intent and keywords of the query carefully.
-            
-            Return ONLY the name of the agent (e.g., "incident_response", "threat_intelligence", "prevention").
-            Do NOT include any other text or explanation."""
-        )
+        if preferred_agent_type and not is_follow_up:
+            logger.debug("Using preferred agent from state: %s", preferred_agent_type)
+            updates["agent_type"] = preferred_agent_type
+        else:
+            updates["agent_type"] = await self._route_with_llm(query_content)
+
+        if updates["needs_collaboration"]:
+            # The agent the query was routed to leads a consultation.
+            updates["primary_agent"] = updates["agent_type"]
+        return updates
+
+    async def _route_with_llm(self, query_content: str) -> str:
+        """Ask the routing LLM which specialist should answer the query.
+
+        Decisions are kept in a small LRU keyed on the normalized query, so repeated questions skip the LLM.
+        """
+        cache_key = _normalize_query(query_content)
+        cached_agent_type = self._route_cache.get(cache_key)
+        if cached_agent_type is not None:
+            self._route_cache.move_to_end(cache_key)
+            logger.debug("Routing cache hit: %s", cached_agent_type)
+            return cached_agent_type
 
         user_query_message = HumanMessage(content=query_content)
         
-        response = await self.llm.ainvoke([routing_prompt, user_query_message])
+        response = await gated_ainvoke(self.llm, [_ROUTING_PROMPT, user_query_message])
         routed_agent_type = response.content.strip().lower()
 
         valid_agents = ["incident_response", "threat_intelligence", "prevention"]
         if routed_agent_type not in valid_agents:
-            print(f"  - Invalid agent type routed by LLM: {routed_agent_type}. Defaulting to incident_response.")
+            logger.warning("Invalid agent type routed by LLM: %s. Defaulting to incident_response.", routed_agent_type)
             routed_agent_type = "incident_response"
 
-        state["agent_type"] = routed_agent_type
-        print(f"  - LLM Routed Agent: {routed_agent_type}")
-        print("-" * 40)
-        return state
+        logger.debug("LLM routed agent: %s", routed_agent_type)
+        self._route_cache[cache_key] = routed_agent_type
+        if len(self._route_cache) > ROUTE_CACHE_SIZE:
+            self._route_cache.popitem(last=False)
+        return routed_agent_type
 
     async def _detect_follow_up(self, current_query: str, chat_history: list[BaseMessage]) -> bool:
         """Detects if the current query is a follow-up to previous conversation."""
@@ -81,7 +151,7 @@ class RouterAgent:
             New Query: {current_query}
             """
         )
-        response = await self.llm.ainvoke([follow_up_prompt])
+        response = await gated_ainvoke(self.llm, [follow_up_prompt])
         return response.content.strip().lower() == "yes"
 
     async def _detect_collaboration_need(self, query: str) -> Dict[str, any]:
@@ -89,31 +159,4 @@ class RouterAgent:
         Detects if the query requires collaboration between multiple agents.
         Returns a dictionary with 'mode' (single_agent, consultation, multi_perspective) and 'needs_collaboration' (bool).
         """
-        query_lower = query.lower()
-
-        agent_type_indicators = {
-            "incident_response": ["incident", "breach", "attack", "compromise", "response", "remediation", "containment", "recovery"],
-            "threat_intelligence": ["threat", "actor", "campaign", "ioc", "ttp", "vulnerability", "exploit", "malware", "ransomware", "advisory", "report"],
-            "prevention": ["prevent", "security", "framework", "policy", "best practice", "control", "guideline", "architecture", "design", "mitigation"]
-        }
-
-        mentioned_types = sum(
-            1 for indicators in agent_type_indicators.values()
-            if any(indicator in query_lower for indicator in indicators)
-        )
-
-        if mentioned_types > 1:
-            return {"mode": "multi_perspective", "needs_collaboration": True}
-
-        high_stakes_indicators = [
-            "critical", "severe", "serious", "major", "significant",
-            "important", "crucial", "vital", "essential", "key",
-            "sensitive", "confidential", "private", "restricted",
-            "emergency", "urgent", "immediate", "priority", "high-priority",
-            "high-risk", "high-value", "high-impact", "high-stakes"
-        ]
-
-        if any(word in query_lower for word in high_stakes_indicators):
-            return {"mode": "consultation", "needs_collaboration": True}
-
-        return {"mode": "single_agent", "needs_collaboration": False}
\ No newline at end of file
+        return detect_collaboration_need(query)
@@ -2,9 +2,87 @@
 from langchain_core.language_models.chat_models import BaseChatModel
 from langchain_core.messages import HumanMessage, SystemMessage, AIMessage
 from .state import AgentState
-from .tools import search_knowledge_base, web_search
-from typing import Dict, List, Optional
+from .tools import get_query_embedding, search_knowledge_base, web_search
+from .llm_gate import gated_ainvoke, gated_astream
+from utils.tokens import count_tokens, truncate_to_tokens
+from typing import Dict, List, Optional, Tuple
+import hashlib
 import json
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+WEB_CONTEXT_TOKEN_BUDGET = 4000
+KB_CONTEXT_TOKEN_BUDGET = 2000
+SECONDARY_DOC_TOKEN_BUDGET = 500
+
+# Static prompts are built once; only the per-query HumanMessage is created on each call.
+_QUERY_ANALYSIS_PROMPT = SystemMessage(content=(
+    "You are a query analyzer for a cybersecurity assistant. "
+    "Given a user query, answer two questions and respond ONLY with a JSON object of the form "
+    '{"intent_score": <number>, "needs_web_search": "yes" | "no"}. '
+    "Do not explain your answer.\n\n"
+    "intent_score is a number between 0.0 and 1.0. "
+    "1.0 means the query is highly related to cybersecurity. "
+    "0.0 means the query is not related to cybersecurity at all.\n"
+    "Here is a list of cybersecurity-related keywords and concepts: "
+    "cybersecurity, malware, ransomware, phishing, threat intelligence, incident response, vulnerability, CVE, exploit, SIEM, firewall, intrusion, detection, prevention, attack, breach, data leak, encryption, authentication, access control, risk, compliance, NIST, MITRE, TTP, IOC, forensics, pentest, red team, blue team, zero-day, patch, security policy, endpoint, SOC, CISO, cybercrime, hacking, DDoS, botnet, rootkit, spyware, keylogger, vulnerability management, security framework, defense, mitigation, response, recovery, security awareness, password, MFA, privilege, escalation, social engineering, spearphishing, whaling, smishing, vishing, cyberattack, cyber defense, cyber threat, cyber risk, cyber hygiene, cyber law, cyber insurance, cyber policy, cyber incident, cyber investigation, cyber operations, cyber warfare, cyber espionage, cyber resilience, cyber safety, cyber strategy, cyber training, digital forensics, information security, network security, application security, cloud security, endpoint security, identity management, access management, security operations, security monitoring, security analytics, security automation, security orchestration, vulnerability assessment, vulnerability scanning, vulnerability remediation, vulnerability disclosure, vulnerability exploitation, vulnerability research, vulnerability scanning, vulnerability testing, vulnerability validation, vulnerability verification, vulnerability workflow, vulnerability workflow management, vulnerability workflow process, vulnerability workflow system, vulnerability workflow tool, vulnerability workflow automation, vulnerability workflow orchestration, vulnerability workflow platform, vulnerability workflow solution, vulnerability workflow software, vulnerability workflow service, vulnerability workflow provider, vulnerability workflow vendor, vulnerability workflow consultant, vulnerability workflow expert, vulnerability workflow specialist, vulnerability workflow engineer, vulnerability workflow analyst, vulnerability workflow manager, vulnerability workflow director, vulnerability workflow leader, vulnerability workflow architect, vulnerability workflow designer, vulnerability workflow developer, vulnerability workflow tester, vulnerability workflow auditor, vulnerability workflow assessor, vulnerability workflow reviewer, vulnerability workflow evaluator, vulnerability workflow investigator, vulnerability workflow responder, vulnerability workflow handler, vulnerability workflow coordinator, vulnerability workflow communicator, vulnerability workflow trainer, vulnerability workflow educator, vulnerability workflow mentor, vulnerability workflow coach, vulnerability workflow advisor. "
+    "If the query is about any of these topics or closely related, score it higher. If it is not related, score it lower.\n\n"
+    "needs_web_search is 'yes' if the query requires current, real-time, or recent information that would need a web search.\n"
+    "Examples that need web search:\n"
+    "- Current time, date, weather\n"
+    "- Recent events, news, incidents\n"
+    "- Latest versions, updates, releases\n"
+    "- Current prices, rates, statistics\n"
+    "- Recent vulnerabilities, exploits, threats\n"
+    "- Anything with temporal indicators (today, now, latest, recent, current, 2024, etc.)\n"
+    "Examples that don't need web search:\n"
+    "- General concepts, definitions\n"
+    "- Historical information\n"
+    "- Technical explanations\n"
+    "- Best practices that don't change frequently"
+))
+
+# Models sometimes wrap the analysis JSON in a Markdown code fence despite the prompt.
+_CODE_FENCE_RE = re.compile(r"^```(?:json)?\s*|\s*```$", re.IGNORECASE)
+# Keyword heuristics used when the analysis response cannot be parsed.
+_FALLBACK_SECURITY_RE = re.compile(
+    r"\b(?:cyber|security|malware|ransomware|phishing|threat|vulnerab|exploit|attack|breach|CVE|IOC|firewall|"
+    r"incident|intrusion|forensic|pentest|zero-day|botnet|encryption|authentication)",
+    re.IGNORECASE
+)
+_FALLBACK_TEMPORAL_RE = re.compile(r"\b(?:today|now|latest|recent|recently|current|currently|news|this (?:week|month|year)|20\d{2})\b", re.IGNORECASE)
+
+_GENERAL_RESPONSE_PROMPT = SystemMessage(
+    content="You are a helpful assistant. Use the provided context to answer the user's query. Be sure to reference and cite sources when appropriate."
+)
+
+
+def _pack_context(sections: List[str], token_budget: int) -> str:
+    """Join context sections, given in priority order, within a token budget.
+
+    The top-ranked section may use the whole budget; every other section is capped at SECONDARY_DOC_TOKEN_BUDGET.
+    """
+    packed = []
+    remaining = token_budget
+    for i, section in enumerate(sections):
+        if remaining <= 0:
+            break
+        limit = remaining if i == 0 else min(remaining, SECONDARY_DOC_TOKEN_BUDGET)
+        section = truncate_to_tokens(section, limit)
+        remaining -= count_tokens(section)
+        packed.append(section)
+    return "\n\n".join(packed)
+
+
+def _doc_id(doc: dict) -> str:
+    """Stable identifier for a retrieved document: its URL for web results, its vector store id for KB chunks."""
+    if doc.get("source") == "web_search":
+        return f"web:{doc.get('url', '')}"
+    doc_id = doc.get("id") or hashlib.sha1(doc.get("content", "").encode("utf-8")).hexdigest()[:16]
+    return f"kb:{doc_id}"
+
 
 class BaseAgent:
     """Base class for specialized cybersecurity agents."""
@@ -14,124 +92,107 @@ class BaseAgent:
         self.tools = [search_knowledge_base, web_search]
         self.agent_type = agent_type
         self.system_prompt = system_prompt
+        self.system_message = SystemMessage(content=system_prompt)
         
-    async def get_cybersecurity_intent_score(self, query: str) -> float:
-        """Use the LLM to score how likely a query is cybersecurity-related (1.0) vs. not (0.0)."""
-        system_prompt = (
-            "You are an intent classifier for a cybersecurity assistant. "
-            "Given a user query, respond ONLY with a number between 0.0 and 1.0. "
-            "1.0 means the query is highly related to cybersecurity. "
-            "0.0 means the query is not related to cybersecurity at all. "
-            "Do not explain your answer.\n"
-            "Here is a list of cybersecurity-related keywords and concepts: "
-            "cybersecurity, malware, ransomware, phishing, threat intelligence, incident response, vulnerability, CVE, exploit, SIEM, firewall, intrusion, detection, prevention, attack, breach, data leak, encryption, authentication, access control, risk, compliance, NIST, MITRE, TTP, IOC, forensics, pentest, red team, blue team, zero-day, patch, security policy, endpoint, SOC, CISO, cybercrime, hacking, DDoS, botnet, rootkit, spyware, keylogger, vulnerability management, security framework, defense, mitigation, response, recovery, security awareness, password, MFA, privilege, escalation, social engineering, spearphishing, whaling, smishing, vishing, cyberattack, cyber defense, cyber threat, cyber risk, cyber hygiene, cyber law, cyber insurance, cyber policy, cyber incident, cyber investigation, cyber operations, cyber warfare, cyber espionage, cyber resilience, cyber safety, cyber strategy, cyber training, digital forensics, information security, network security, application security, cloud security, endpoint security, identity management, access management, security operations, security monitoring, security analytics, security automation, security orchestration, vulnerability assessment, vulnerability scanning, vulnerability remediation, vulnerability disclosure, vulnerability exploitation, vulnerability research, vulnerability scanning, vulnerability testing, vulnerability validation, vulnerability verification, vulnerability workflow, vulnerability workflow management, vulnerability workflow process, vulnerability workflow system, vulnerability workflow tool, vulnerability workflow automation, vulnerability workflow orchestration, vulnerability workflow platform, vulnerability workflow solution, vulnerability workflow software, vulnerability workflow service, vulnerability workflow provider, vulnerability workflow vendor, vulnerability workflow consultant, vulnerability workflow expert, vulnerability workflow specialist, vulnerability workflow engineer, vulnerability workflow analyst, vulnerability workflow manager, vulnerability workflow director, vulnerability workflow leader, vulnerability workflow architect, vulnerability workflow designer, vulnerability workflow developer, vulnerability workflow tester, vulnerability workflow auditor, vulnerability workflow assessor, vulnerability workflow reviewer, vulnerability workflow evaluator, vulnerability workflow investigator, vulnerability workflow responder, vulnerability workflow handler, vulnerability workflow coordinator, vulnerability workflow communicator, vulnerability workflow trainer, vulnerability workflow educator, vulnerability workflow mentor, vulnerability workflow coach, vulnerability workflow advisor. "
-            "If the query is about any of these topics or closely related, score it higher. If it is not related, score it lower."
-        )
-        prompt = [
-            SystemMessage(content=system_prompt),
-            HumanMessage(content=f"User query: {query}")
-        ]
-        response = await self.llm.ainvoke(prompt)
+    async def analyze_query(self, query: str, llm: BaseChatModel) -> Tuple[float, bool]:
+        """Score cybersecurity intent (0.0-1.0) and decide whether web search is needed, in a single LLM call."""
+        prompt = [_QUERY_ANALYSIS_PROMPT, HumanMessage(content=f"User query: {query}")]
+        response = await gated_ainvoke(llm, prompt)
         try:
-            score = float(response.content.strip())
-            return min(max(score, 0.0), 1.0)
+            analysis = json.loads(_CODE_FENCE_RE.sub("", response.content.strip()))
         except Exception:
-            return 0.5
-    
-    async def needs_web_search(self, query: str) -> bool:
-        """Determine if a query needs web search based on temporal/current information needs."""
-        system_prompt = (
-            "You are a query analyzer. Determine if the following query requires current, real-time, or recent information that would need a web search. "
-            "Respond with ONLY 'yes' or 'no'.\n"
-            "Examples that need web search:\n"
-            "- Current time, date, weather\n"
-            "- Recent events, news, incidents\n"
-            "- Latest versions, updates, releases\n"
-            "- Current prices, rates, statistics\n"
-            "- Recent vulnerabilities, exploits, threats\n"
-            "- Anything with temporal indicators (today, now, latest, recent, current, 2024, etc.)\n"
-            "Examples that don't need web search:\n"
-            "- General concepts, definitions\n"
-            "- Historical information\n"
-            "- Technical explanations\n"
-            "- Best practices that don't change frequently"
-        )
-        prompt = [
-            SystemMessage(content=system_prompt),
-            HumanMessage(content=f"Query: {query}")
-        ]
-        response = await self.llm.ainvoke(prompt)
-        return response.content.strip().lower() == "yes"
+            analysis = None
+        if not isinstance(analysis, dict):
+            logger.warning("Could not parse query analysis, using keyword heuristics: %r", response.content[:200])
+            return self._keyword_analysis(query)
+
+        try:
+            score = min(max(float(analysis.get("intent_score", 0.5)), 0.0), 1.0)
+        except Exception:
+            score = 0.5
+        needs_search = str(analysis.get("needs_web_search", "no")).strip().lower() in ("yes", "true")
+        return score, needs_search
+
+    @staticmethod
+    def _keyword_analysis(query: str) -> Tuple[float, bool]:
+        """Fallback for analyze_query: security keywords raise the intent score, temporal words ask for web search."""
+        score = 0.8 if _FALLBACK_SECURITY_RE.search(query) else 0.5
+        return score, _FALLBACK_TEMPORAL_RE.search(query) is not None
 
     async def perform_web_search(self, query: str, agent_type: str) -> List[dict]:
         """Perform web search and return structured documents."""
-        print("  - Performing web search...")
+        logger.debug("Performing web search")
         # This now returns a list of dicts directly
         web_search_docs = await web_search.ainvoke({"query": query, "agent_type": agent_type})
 
         # Gracefully handle potential errors from the tool
         if web_search_docs and isinstance(web_search_docs[0], dict) and "error" in web_search_docs[0]:
-            print(f"  - Web search failed: {web_search_docs[0]['error']}")
+            logger.warning("Web search failed: %s", web_search_docs[0]["error"])
             return []
         
-        if web_search_docs:
-            print(f"  - Retrieved {len(web_search_docs)} web search documents.")
-        else:
-            print("  - No results parsed from web search.")
-        
+        logger.debug("Retrieved %d web search documents", len(web_search_docs))
         return web_search_docs
 
     async def process_async(self, state: AgentState) -> AgentState:
         """Processes a query using the agent's specific LLM and tools."""
-        print(f"\n⚙️ {self.agent_type.replace('_', ' ').title()} Agent Processing:")
-        print("-" * 40)
+        logger.debug("%s agent processing", self.agent_type)
 
         current_query = state["messages"][-1].content
         llm_choice = state.get("llm_choice", "openai_mini")
-        self.llm = self.llm_map.get(llm_choice, self.llm_map["openai_mini"])
+        llm = self.llm_map.get(llm_choice, self.llm_map["openai_mini"])
         history = state["messages"]
 
-        intent_score = await self.get_cybersecurity_intent_score(current_query)
-        print(f"Cybersecurity intent score: {intent_score:.2f}")
+        intent_score, needs_search = await self.analyze_query(current_query, llm)
+        logger.debug("Cybersecurity intent score: %.2f", intent_score)
         state["thought_process"].append(f"Cybersecurity intent score: {intent_score:.2f}")
 
-        needs_search = await self.needs_web_search(current_query)
-        print(f"Needs web search: {needs_search}")
+        logger.debug("Needs web search: %s", needs_search)
         state["thought_process"].append(f"Web search needed: {needs_search}")
 
+        # Document text only lives for this call; the state keeps just the IDs.
+        retrieved_docs: List[dict] = []
         web_search_docs = []
         if needs_search:
             web_search_docs = await self.perform_web_search(current_query, self.agent_type)
             if web_search_docs:
-                state["retrieved_docs"].extend(web_search_docs)
+                retrieved_docs.extend(web_search_docs)
                 state["thought_process"].append(f"Web search performed. Retrieved {len(web_search_docs)} documents.")
 
         knowledge_base_results = []
         if intent_score >= 0.3:
-            print("  - Query is cybersecurity-related. Searching knowledge base...")
-            knowledge_base_results = await search_knowledge_base.ainvoke({"query": current_query, "agent_type": self.agent_type})
+            try:
+                query_embedding = await get_query_embedding(current_query)
+            except Exception:
+                # The search embeds the query itself and answers without KB context if that fails too.
+                logger.warning("Could not embed the query for the knowledge base search", exc_info=True)
+                query_embedding = None
+            knowledge_base_results = await search_knowledge_base.ainvoke({
+                "query": current_query,
+                "agent_type": self.agent_type,
+                "precomputed_embedding": query_embedding,
+            })
             if knowledge_base_results:
-                state["retrieved_docs"].extend(knowledge_base_results)
+                retrieved_docs.extend(knowledge_base_results)
                 state["thought_process"].append(f"Retrieved {len(knowledge_base_results)} docs from knowledge base.")
-                print(f"  - Retrieved {len(knowledge_base_results)} docs from knowledge base.")
+                logger.debug("Retrieved %d docs from knowledge base", len(knowledge_base_results))
             else:
                 state["thought_process"].append("No relevant docs found in knowledge base.")
-                print("  - No relevant docs found in knowledge base.")
+                logger.debug("No relevant docs found in knowledge base")
         else:
-            print("  - Query is not cybersecurity-related. Skipping knowledge base search.")
+            logger.debug("Query is not cybersecurity-related; skipping knowledge base search")
             state["thought_process"].append("Non-cybersecurity query - skipped knowledge base search.")
 
-        kb_context = "\n\n".join([
+        kb_context = _pack_context([
             f"Source: {doc.get('source', 'knowledge_base')}\n{doc.get('content', '')}" 
-            for doc in state["retrieved_docs"] 
+            for doc in retrieved_docs 
             if doc.get("source") != "web_search" and doc.get("content")
-        ])
+        ], KB_CONTEXT_TOKEN_BUDGET)
         
-        web_context = "\n\n".join([
-            f"{'🔐 TRUSTED ' if doc.get('is_trusted') else ''}Web Source: {doc.get('url', 'Unknown')}\nTitle: {doc.get('title', 'No title')}\n{doc.get('raw_content', doc.get('content', ''))}"
-            for doc in state["retrieved_docs"]
+        web_context = _pack_context([
+            f"{'🔐 TRUSTED ' if doc.get('is_trusted') else ''}Web Source: {doc.get('url', 'Unknown')}\nTitle: {doc.get('title', 'No title')}\n{doc.get('raw_content') or doc.get('content', '')}"
+            for doc in retrieved_docs
             if doc.get("source") == "web_search"
-        ])
+        ], WEB_CONTEXT_TOKEN_BUDGET)
         
         context = ""
         if web_context:
@@ -142,28 +203,24 @@ class BaseAgent:
         if not context.strip():
             context = "No specific context found. Provide a general answer based on your expertise."
 
-        if intent_score < 0.3:
-            response_prompt = "You are a helpful assistant. Use the provided context to answer the user's query. Be sure to reference and cite sources when appropriate."
-        else:
-            response_prompt = self.system_prompt
+        response_prompt = _GENERAL_RESPONSE_PROMPT if intent_score < 0.3 else self.system_message
 
         history_without_current = history[:-1]
         human_message_with_context = HumanMessage(
             content=f"Context:\n{context}\n\nUser Query: {current_query}"
         )
-        prompt_messages = [SystemMessage(content=response_prompt)] + history_without_current + [human_message_with_context]
+        prompt_messages = [response_prompt] + history_without_current + [human_message_with_context]
 
-        response = await self.llm.ainvoke(prompt_messages)
+        response = await gated_astream(llm, prompt_messages)
         final_answer = response.content
 
         state["messages"].append(AIMessage(content=final_answer))
         state["agent_type"] = self.agent_type
-        state["confidence_score"] = self._calculate_confidence(final_answer, state["retrieved_docs"])
+        state["retrieved_doc_ids"].extend(_doc_id(doc) for doc in retrieved_docs)
+        state["confidence_score"] = self._calculate_confidence(final_answer, retrieved_docs)
         
-        print(f"  - Agent response generated. Confidence: {state['confidence_score']:.2f}")
-        print(f"  - Total docs used: {len(state['retrieved_docs'])} (Web: {len(web_search_docs)}, KB: {len(knowledge_base_results)})")
-        print(f"  - Query type: {'Cybersecurity' if intent_score >= 0.3 else 'Non-cybersecurity'}")
-        print("-" * 40)
+        logger.debug("Agent response generated: confidence=%.2f docs=%d (web=%d, kb=%d)",
+                     state["confidence_score"], len(retrieved_docs), len(web_search_docs), len(knowledge_base_results))
         
         return state
 
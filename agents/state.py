@@ -15,7 +15,7 @@ class AgentState(TypedDict):
     """Represents the state of an agent, including its messages and metadata."""
     messages: Annotated[List[BaseMessage], add_messages]
     agent_type: str
-    retrieved_docs: List[dict]
+    retrieved_doc_ids: List[str]  # IDs of the documents used for the answer; their text is not checkpointed
     confidence_score: float
     preferred_agent: str # Preferred agent for the query
     llm_choice: str  # LLM choice for the query
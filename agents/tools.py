@@ -1,33 +1,56 @@
 # tools.py
+import asyncio
+import logging
+from contextvars import ContextVar
 from langchain_core.tools import tool
 from db.vector_store import DatabaseManager
 from integrations.web_search import TavilyWebSearch
 from typing import List, Optional, Dict # Make sure Dict is imported
 
+logger = logging.getLogger(__name__)
+
 db_manager = DatabaseManager()
 
 try:
-    web_searcher = TavilyWebSearch()
+    # Reuse the knowledge-base embedder so near-duplicate web searches hit the search cache.
+    web_searcher = TavilyWebSearch(embed_query=db_manager.aembed_query)
     WEB_SEARCH_AVAILABLE = True
 except ValueError as e:
-    print(f"--- [WEB SEARCH TOOL ERROR] ---")
-    print(f"Description: The web search tool could not be initialized.")
-    print(f"Error: {e}")
-    print(f"Troubleshooting: Please ensure the TAVILY_API_KEY is set in your .env file.")
-    print(f"---------------------------------")
+    logger.error("The web search tool could not be initialized: %s. "
+                 "Please ensure the TAVILY_API_KEY is set in your .env file.", e)
     web_searcher = None
     WEB_SEARCH_AVAILABLE = False
 
+# Query text -> embedding task for the current graph run. The caller sets a fresh dict per run; graph nodes
+# run in copies of its context that share the dict, so one node's embedding is reused by the others without
+# going through the checkpointed state. None (e.g. when the graph is invoked directly) disables reuse.
+query_embeddings: ContextVar[Optional[Dict[str, "asyncio.Task[List[float]]"]]] = ContextVar("query_embeddings", default=None)
+
+async def get_query_embedding(query: str) -> List[float]:
+    """Embed query, at most once per graph run.
+
+    The pending task is cached rather than the result, so agents consulted concurrently share one embedding.
+    """
+    run_embeddings = query_embeddings.get()
+    if run_embeddings is None:
+        return await db_manager.aembed_query(query)
+    task = run_embeddings.get(query)
+    if task is None:
+        task = run_embeddings[query] = asyncio.ensure_future(db_manager.aembed_query(query))
+    # Shielded so one cancelled waiter does not cancel the embedding for the others.
+    return await asyncio.shield(task)
+
 @tool
-async def search_knowledge_base(query: str, agent_type: Optional[str] = None, k: int = 5) -> List[dict]:
+async def search_knowledge_base(query: str, agent_type: Optional[str] = None, k: int = 5, precomputed_embedding: Optional[List[float]] = None) -> List[dict]:
     """Search the knowledge base for cybersecurity information.
     
     Args:
         query: The search query
         agent_type: Optional agent type to filter results (incident_response, threat_intelligence, prevention)
         k: Number of results to return (default: 5)
+        precomputed_embedding: Optional embedding of the query; skips re-embedding when provided
     """
-    results = await db_manager.asearch(query, agent_type=agent_type, k=k)
+    results = await db_manager.asearch(query, agent_type=agent_type, k=k, embedding=precomputed_embedding)
     return results
 
 @tool
@@ -37,12 +60,10 @@ async def web_search(query: str, agent_type: Optional[str] = None) -> List[Dict]
         return [{"error": "Web search is not available. Check TAVILY_API_KEY."}]
     
     try:
-        print("DEBUG - Performing web search with query:", query)
+        logger.debug("Performing web search with query: %s", query)
         result = await web_searcher.search(query, agent_type)
-        print(f"DEBUG - Web Search found {len(result)} results.")
+        logger.debug("Web search found %d results", len(result))
         return result
     except Exception as e:
-        import traceback
-        error_details = f"Web search tool failed: {str(e)}\nTraceback: {traceback.format_exc()}"
-        print(error_details)
+        logger.exception("Web search tool failed")
         return [{"error": f"Web search tool failed: {str(e)}"}]
\ No newline at end of file
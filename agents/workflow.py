@@ -1,46 +1,183 @@
 # workflow.py
 
-import uuid
+import asyncio
+import functools
+import logging
 from langgraph.graph import StateGraph, END
-from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
-from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+from langchain_core.messages import HumanMessage, AIMessage, SystemMessage, BaseMessage
 from langchain_openai import ChatOpenAI
 from langchain_anthropic import ChatAnthropic
 from langchain_core.language_models.chat_models import BaseChatModel
-from typing import Optional, Dict
+from typing import Callable, Optional, Dict, List, Union
+from collections.abc import Mapping
 from pathlib import Path
+from types import MappingProxyType
 
 from .state import AgentState, ConversationTurn
-from .router import RouterAgent
+from .router import RouterAgent, detect_collaboration_need
 from .specialized_agents import IncidentResponseAgent, ThreatIntelligenceAgent, PreventionAgent
 from .collaboration import CollaborationSystem
+from .llm_gate import gated_ainvoke, response_token_sink
+from .checkpointer import DualPoolSqliteSaver
+from .tools import db_manager, query_embeddings
+from utils.ids import new_session_id
+from utils.tokens import count_tokens, truncate_to_tokens
+
+logger = logging.getLogger(__name__)
+
+# Conversations with fewer messages are not summarized; longer ones are summarized alongside routing.
+SUMMARY_MIN_MESSAGES = 4
+# Token limits for the summarizer prompt: per message, and for the whole rendered history.
+SUMMARY_MESSAGE_TOKEN_LIMIT = 400
+SUMMARY_PROMPT_TOKEN_BUDGET = 3000
+
+SPECIALIST_NODES = ("incident_response", "threat_intelligence", "prevention")
+
+# Per-query state reset values. Only immutable values live here: nodes extend the list/dict fields
+# in place, so those are created fresh for every query.
+_INITIAL_STATE_TEMPLATE = MappingProxyType({
+    "agent_type": None,
+    "confidence_score": 0.0,
+    "needs_routing": True,
+    "is_follow_up": False,
+    "collaboration_mode": "single_agent",
+    "needs_collaboration": False,
+    "primary_agent": None,
+    "collaboration_confidence": None,
+    "needs_web_search": False,
+})
+
+# Result key -> (state key, default) for values copied straight from the final graph state.
+_STATE_OUTPUT_FIELDS = {
+    "agent_type": ("agent_type", None),
+    "confidence_score": ("confidence_score", 0.0),
+    "collaboration_mode": ("collaboration_mode", "single_agent"),
+    "overall_conversation_summary": ("conversation_summary", None),
+    "final_llm_choice": ("llm_choice", None),
+}
+
+# Only meaningful when the team collaborated; single-agent results leave them out.
+_COLLABORATION_OUTPUT_FIELDS = {
+    "primary_agent": ("primary_agent", None),
+    "collaboration_confidence": ("collaboration_confidence", None),
+    "consulting_agents": ("consulting_agents", []),
+    "agent_responses": ("agent_responses", {}),
+}
+
+
+_LLM_FACTORIES = {
+    "claude_sonnet": lambda: ChatAnthropic(model="claude-3-5-sonnet-20240620", temperature=0.1),
+    "openai_mini": lambda: ChatOpenAI(model="gpt-4o-mini", temperature=0.1),
+    "gpt4o": lambda: ChatOpenAI(model="gpt-4o", temperature=0.2),
+}
+
+
+@functools.cache
+def _get_llm(key: str) -> BaseChatModel:
+    """Construct the chat model for key on first use and reuse it afterwards."""
+    return _LLM_FACTORIES[key]()
+
+
+class _LazyLLMMap(Mapping):
+    """Read-only LLM map that only builds a client when its key is first looked up.
+
+    Importing this module therefore no longer constructs every provider's HTTP client up front.
+    """
+
+    def __getitem__(self, key: str) -> BaseChatModel:
+        if key not in _LLM_FACTORIES:
+            raise KeyError(key)
+        return _get_llm(key)
+
+    def __contains__(self, key) -> bool:
+        return key in _LLM_FACTORIES
+
+    def __iter__(self):
+        return iter(_LLM_FACTORIES)
+
+    def __len__(self) -> int:
+        return len(_LLM_FACTORIES)
+
+
+LLM_MAP = _LazyLLMMap()
+
+
+@functools.cache
+def _ensure_dir(path: str) -> None:
+    """Create path (and parents) at most once per process."""
+    Path(path).mkdir(parents=True, exist_ok=True)
+
+
+def _format_history_for_summary(messages: List[BaseMessage]) -> str:
+    """Render messages for the summarizer within SUMMARY_PROMPT_TOKEN_BUDGET.
+
+    Each message is capped at SUMMARY_MESSAGE_TOKEN_LIMIT tokens. If the total is still over budget,
+    messages are taken alternately from the start and the end and the middle of the conversation is dropped.
+    """
+    lines = [
+        truncate_to_tokens(f"{'User' if isinstance(msg, HumanMessage) else 'Assistant'}: {msg.content}", SUMMARY_MESSAGE_TOKEN_LIMIT)
+        for msg in messages
+    ]
+    costs = [count_tokens(line) for line in lines]
+    if sum(costs) <= SUMMARY_PROMPT_TOKEN_BUDGET:
+        return "\n".join(lines)
+
+    head, tail = [], []
+    remaining = SUMMARY_PROMPT_TOKEN_BUDGET
+    first, last = 0, len(lines) - 1
+    take_first = True
+    while first <= last:
+        index = first if take_first else last
+        if costs[index] > remaining:
+            break
+        remaining -= costs[index]
+        if take_first:
+            head.append(lines[first])
+            first += 1
+        else:
+            tail.append(lines[last])
+            last -= 1
+        take_first = not take_first
+
+    return "\n".join(head + ["[... earlier messages omitted ...]"] + tail[::-1])
+
+
+def _route(state: AgentState) -> str:
+    """Send the query to the team when the router asked for collaboration, otherwise to the routed specialist."""
+    return "team_collaboration" if state.get("needs_collaboration") else state["agent_type"]
+
+
+@functools.cache
+def _get_agents():
+    """Build the router, specialists and collaboration system once per process.
+
+    The agents hold no per-session state, so every workflow instance shares them (and their LLM clients' connection pools).
+    """
+    router = RouterAgent(llm_map=LLM_MAP, router_llm_key="openai_mini")
+    ir_agent = IncidentResponseAgent(llm_map=LLM_MAP)
+    ti_agent = ThreatIntelligenceAgent(llm_map=LLM_MAP)
+    prevention_agent = PreventionAgent(llm_map=LLM_MAP)
+    collaboration_system = CollaborationSystem(
+        ir_agent=ir_agent,
+        ti_agent=ti_agent,
+        prevention_agent=prevention_agent,
+        llm_map=LLM_MAP
+    )
+    return router, ir_agent, ti_agent, prevention_agent, collaboration_system
 
 
 class CybersecurityRAGWorkflow:
-    LLM_MAP = {
-        "claude_sonnet": ChatAnthropic(model="claude-3-5-sonnet-20240620", temperature=0.1),
-        "openai_mini": ChatOpenAI(model="gpt-4o-mini", temperature=0.1),
-        "gpt4o": ChatOpenAI(model="gpt-4o", temperature=0.2),
-    }
+    LLM_MAP = LLM_MAP
 
     def __init__(self, llm_choice: str = "openai_mini") -> None:
         self.llm_choice = llm_choice
         
-        self.router = RouterAgent(llm_map=self.LLM_MAP, router_llm_key="openai_mini")
-        self.ir_agent = IncidentResponseAgent(llm_map=self.LLM_MAP)
-        self.ti_agent = ThreatIntelligenceAgent(llm_map=self.LLM_MAP)
-        self.prevention_agent = PreventionAgent(llm_map=self.LLM_MAP)
-
-        self.summarize_conversation_llm = self.LLM_MAP.get(self.llm_choice, self.LLM_MAP["openai_mini"])
-
-        self.collaboration_system = CollaborationSystem(
-            ir_agent=self.ir_agent,
-            ti_agent=self.ti_agent,
-            prevention_agent=self.prevention_agent,
-            llm_map=self.LLM_MAP
-        )
+        (self.router, self.ir_agent, self.ti_agent,
+         self.prevention_agent, self.collaboration_system) = _get_agents()
 
-        self.workflow = self._build_workflow()
+        self.workflow = self._build_workflow(
+            self.router, self.ir_agent, self.ti_agent, self.prevention_agent, self.collaboration_system
+        )
         self.checkpointer_manager = self._create_checkpointer_manager()
         self.checkpointer = None  # Will be set in initialize
         self.app = None  # Will be set in initialize
@@ -51,6 +188,22 @@ class CybersecurityRAGWorkflow:
             self.checkpointer = await self.checkpointer_manager.__aenter__()
             self.app = self.workflow.compile(checkpointer=self.checkpointer)
 
+    async def warmup(self):
+        """Load the vector store, run the embedding model once and open the default LLM connection.
+
+        Keeps those one-time costs off the first user query. Failures are only logged.
+        """
+        llm = self.LLM_MAP.get(self.llm_choice, self.LLM_MAP["openai_mini"])
+        results = await asyncio.gather(
+            asyncio.to_thread(db_manager.get_vector_store),
+            db_manager.aembed_query("warmup"),
+            llm.bind(max_tokens=1).ainvoke([HumanMessage(content="ping")]),
+            return_exceptions=True,
+        )
+        for step, result in zip(("vector store", "embedding model", "LLM client"), results):
+            if isinstance(result, Exception):
+                logger.warning("Warmup of %s failed: %s", step, result)
+
     async def close(self):
         """Cleans up resources by exiting the checkpointer context."""
         if self.checkpointer_manager:
@@ -59,20 +212,24 @@ class CybersecurityRAGWorkflow:
     def _create_checkpointer_manager(self):
         """Creates the checkpointer context manager."""
         checkpoint_dir = Path("data/conversation_checkpoints")
-        checkpoint_dir.mkdir(parents=True, exist_ok=True)
+        _ensure_dir(str(checkpoint_dir))
         db_path = checkpoint_dir / "langgraph.sqlite"
         # Return the context manager object itself
-        return AsyncSqliteSaver.from_conn_string(str(db_path))
+        return DualPoolSqliteSaver.from_conn_string(str(db_path))
 
-    async def summarize_conversation(self, state: AgentState) -> AgentState:
+    @classmethod
+    async def summarize_conversation(cls, state: AgentState) -> AgentState:
         """Summarizes the conversation history, integrating the new query."""
         conversation_history = state.get("conversation_summary", "")
 
         current_query_message = state["messages"][-1]
         new_message_content = current_query_message.content if isinstance(current_query_message, HumanMessage) else ""
+        new_message_content = truncate_to_tokens(new_message_content, SUMMARY_MESSAGE_TOKEN_LIMIT)
 
+        # _entry_nodes only runs this node once the conversation has SUMMARY_MIN_MESSAGES messages.
         if not conversation_history:
-            return {"conversation_summary": new_message_content}
+            # First summary of this thread: start from the raw message history.
+            conversation_history = _format_history_for_summary(state["messages"][:-1])
 
         summary_prompt = SystemMessage(
             content=f"""You are a helpful assistant tasked with summarizing conversation history between a user and a cybersecurity assistant.
@@ -87,36 +244,48 @@ class CybersecurityRAGWorkflow:
             """
         )
 
-        summary = await self.summarize_conversation_llm.ainvoke([summary_prompt])
+        summarize_llm = cls.LLM_MAP.get(state.get("llm_choice"), cls.LLM_MAP["openai_mini"])
+        summary = await gated_ainvoke(summarize_llm, [summary_prompt])
         return {"conversation_summary": summary.content}
 
 
-    def _enhanced_routing_logic(self, state: AgentState) -> str:
-        """Determine the next node based on router's decision and collaboration needs."""
-        if state["needs_collaboration"]:
-            if not state.get("primary_agent"):
-                state["primary_agent"] = state["agent_type"]
-            return "team_collaboration"
-        else:
-            return state["agent_type"]
+    @staticmethod
+    def _entry_nodes(state: AgentState):
+        """Start with the router; long conversations are also summarized in a parallel branch.
 
-    def _build_workflow(self) -> StateGraph:
+        The first query of a conversation with an explicitly chosen specialist goes straight to that agent,
+        unless it calls for collaboration. The router would pick the preferred agent anyway.
+        """
+        messages = state["messages"]
+        preferred_agent = state.get("preferred_agent")
+        if (preferred_agent in SPECIALIST_NODES and len(messages) == 1
+                and not detect_collaboration_need(messages[-1].content)["needs_collaboration"]):
+            return preferred_agent
+        if len(messages) < SUMMARY_MIN_MESSAGES:
+            return "router"
+        return ["summarize_conversation", "router"]
+
+    @classmethod
+    @functools.lru_cache(maxsize=None)
+    def _build_workflow(cls, router, ir_agent, ti_agent, prevention_agent, collaboration_system) -> StateGraph:
+        """Build the agent graph once per set of agents; instances sharing agents reuse the same graph."""
         workflow = StateGraph(AgentState)
 
-        workflow.add_node("summarize_conversation", self.summarize_conversation)
-        workflow.add_node("router", self.router.router_query)
-        workflow.add_node("incident_response", self.ir_agent.process_async)
-        workflow.add_node("threat_intelligence", self.ti_agent.process_async)
-        workflow.add_node("prevention", self.prevention_agent.process_async)
-        workflow.add_node("team_collaboration", self.collaboration_system.multi_agent_consultation_async)
+        workflow.add_node("summarize_conversation", cls.summarize_conversation)
+        workflow.add_node("router", router.router_query)
+        workflow.add_node("incident_response", ir_agent.process_async)
+        workflow.add_node("threat_intelligence", ti_agent.process_async)
+        workflow.add_node("prevention", prevention_agent.process_async)
+        workflow.add_node("team_collaboration", collaboration_system.multi_agent_consultation_async)
 
-        workflow.set_entry_point("summarize_conversation")
+        workflow.set_conditional_entry_point(cls._entry_nodes, ["summarize_conversation", "router", *SPECIALIST_NODES])
 
-        workflow.add_edge("summarize_conversation", "router")
+        # The summary is not an input to the specialists, so its branch ends on its own.
+        workflow.add_edge("summarize_conversation", END)
 
         workflow.add_conditional_edges(
             "router",
-            self._enhanced_routing_logic,
+            _route,
             {
                 "incident_response": "incident_response",
                 "threat_intelligence": "threat_intelligence",
@@ -132,9 +301,11 @@ class CybersecurityRAGWorkflow:
 
         return workflow
 
-    async def process_query_async(self, user_query: str, client_config: Optional[Dict] = None) -> Dict:
+    async def process_query_async(self, user_query: str, client_config: Optional[Dict] = None,
+                                  on_token: Optional[Callable[[str], None]] = None) -> Dict:
         """
         Processes a user query through the LangGraph workflow, allowing for dynamic LLM and agent selection.
+        If on_token is given, it receives the final answer's text as it is generated.
         """
 
         if self.app is None:
@@ -143,32 +314,21 @@ class CybersecurityRAGWorkflow:
         if client_config is None:
             client_config = {}
 
-        thread_id = client_config.get("configurable", {}).get("thread_id", str(uuid.uuid4()))
+        thread_id = client_config.get("configurable", {}).get("thread_id") or new_session_id()
 
         preferred_llm_choice = client_config.get("preferred_llm_choice", self.llm_choice)
         preferred_agent = client_config.get("preferred_agent", None)
 
-        initial_messages = [HumanMessage(content=user_query)]
         initial_state = {
-            "messages": initial_messages,
-            "agent_type": None,
-            "retrieved_docs": [],
-            "confidence_score": 0.0,
-            "needs_routing": True,
-            "thread_id": thread_id,
-            "is_follow_up": False,
-            "preferred_agent": preferred_agent,
-            "llm_choice": preferred_llm_choice,
-
-            "collaboration_mode": "single_agent",
+            **_INITIAL_STATE_TEMPLATE,
+            "messages": [HumanMessage(content=user_query)],
+            "retrieved_doc_ids": [],
             "consulting_agents": [],
             "agent_responses": {},
-            "needs_collaboration": False,
-            "primary_agent": None,
-            "collaboration_confidence": None,
             "thought_process": [],
-            "needs_web_search": False,
-            "conversation_summary": ""
+            "thread_id": thread_id,
+            "preferred_agent": preferred_agent,
+            "llm_choice": preferred_llm_choice,
         }
 
         langgraph_invoke_config = client_config.copy()
@@ -176,47 +336,53 @@ class CybersecurityRAGWorkflow:
             langgraph_invoke_config["configurable"] = {}
         langgraph_invoke_config["configurable"]["thread_id"] = thread_id
 
-        await self.app.ainvoke(initial_state, config=langgraph_invoke_config)
-
-        retrieved_full_state = await self.app.aget_state(langgraph_invoke_config)
-        retrieved_full_state_values = retrieved_full_state.values
-
-        last_response_content = ""
-        for msg in reversed(retrieved_full_state_values["messages"]):
-            if isinstance(msg, AIMessage):
-                last_response_content = msg.content
-                break
-
-        conversation_turns_for_output = []
-        for i in range(0, len(retrieved_full_state_values["messages"]) - 1, 2):
-            user_msg = retrieved_full_state_values["messages"][i]
-            if i + 1 < len(retrieved_full_state_values["messages"]):
-                agent_msg = retrieved_full_state_values["messages"][i+1]
-                if isinstance(user_msg, HumanMessage) and isinstance(agent_msg, AIMessage):
-                    conversation_turns_for_output.append(
-                        ConversationTurn(
-                            user_query=user_msg.content,
-                            agent_response=agent_msg.content,
-                            agent_type=retrieved_full_state_values.get("agent_type", "unknown"),
-                            timestamp="N/A"
-                        )
-                    )
-
-        return {
+        # ainvoke already returns the final state values; no need to read the checkpoint back.
+        sink_token = response_token_sink.set(on_token)
+        embeddings_token = query_embeddings.set({})
+        try:
+            retrieved_full_state_values = await self.app.ainvoke(initial_state, config=langgraph_invoke_config)
+        finally:
+            query_embeddings.reset(embeddings_token)
+            response_token_sink.reset(sink_token)
+
+        msgs = retrieved_full_state_values["messages"]
+        last_response_content = next((m.content for m in reversed(msgs) if isinstance(m, AIMessage)), "")
+
+        turn_agent_type = retrieved_full_state_values.get("agent_type", "unknown")
+        conversation_turns_for_output = [
+            ConversationTurn(
+                user_query=user_msg.content,
+                agent_response=agent_msg.content,
+                agent_type=turn_agent_type,
+                timestamp="N/A"
+            )
+            for user_msg, agent_msg in zip(msgs[0::2], msgs[1::2])
+            if isinstance(user_msg, HumanMessage) and isinstance(agent_msg, AIMessage)
+        ]
+
+        state_get = retrieved_full_state_values.get
+        # The collaboration node clears needs_collaboration when it finishes, so the mode is what records that it ran.
+        was_collaboration = state_get("collaboration_mode", "single_agent") != "single_agent"
+
+        result = {output_key: state_get(state_key, default) for output_key, (state_key, default) in _STATE_OUTPUT_FIELDS.items()}
+        if was_collaboration:
+            result.update({output_key: state_get(state_key, default) for output_key, (state_key, default) in _COLLABORATION_OUTPUT_FIELDS.items()})
+        result.update({
             "session_id": thread_id,
             "user_query": user_query,
             "response": last_response_content,
-            "agent_type": retrieved_full_state_values.get("agent_type"),
-            "primary_agent": retrieved_full_state_values.get("primary_agent"),
-            "confidence_score": retrieved_full_state_values.get("confidence_score", 0.0),
-            "collaboration_confidence": retrieved_full_state_values.get("collaboration_confidence"),
-            "collaboration_mode": retrieved_full_state_values.get("collaboration_mode", "single_agent"),
-            "consulting_agents": retrieved_full_state_values.get("consulting_agents", []),
-            "num_docs_retrieved": len(retrieved_full_state_values.get("retrieved_docs", [])),
+            "num_docs_retrieved": len(state_get("retrieved_doc_ids", [])),
             "conversation_history_summary": conversation_turns_for_output,
-            "overall_conversation_summary": retrieved_full_state_values.get("conversation_summary"),
+            "was_collaboration": was_collaboration,
+        })
+        return result
 
-            "agent_responses": retrieved_full_state_values.get("agent_responses", {}),
-            "was_collaboration": retrieved_full_state_values.get("needs_collaboration", False),
-            "final_llm_choice": retrieved_full_state_values.get("llm_choice")
-        }
\ No newline at end of file
+    async def process_queries_batch(self, user_queries: List[str]) -> List[Union[Dict, Exception]]:
+        """Process independent queries concurrently, each in its own new session.
+
+        Results come back in input order; a query that fails yields its exception instead of a result.
+        """
+        return await asyncio.gather(
+            *(self.process_query_async(user_query) for user_query in user_queries),
+            return_exceptions=True,
+        )
@@ -1,20 +1,75 @@
 # cli.py
 import argparse
+import logging
 from agents.workflow import CybersecurityRAGWorkflow
+from utils.logger import setup_logging, shutdown_logging
+from utils.ids import new_session_id
 from datetime import datetime
-import uuid
 import asyncio
+import threading
+
+# Map agent types to emojis for cleaner display
+_AGENT_ICONS = {
+    "incident_response": "🚨",
+    "threat_intelligence": "🕵️", 
+    "prevention": "🛡️",
+    "team_collaboration": "🤝"
+}
+
+_AGENT_NAMES = {
+    "incident_response": "Incident Response Specialist",
+    "threat_intelligence": "Threat Intelligence Analyst",
+    "prevention": "Security Prevention Expert",
+    "team_collaboration": "Cybersecurity Team"
+}
+
+def _set_future_result(future: asyncio.Future, result, error):
+    """Resolve the input future unless the waiting coroutine has already been cancelled."""
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+async def _ainput(prompt: str) -> str:
+    """Read a line from stdin without blocking the event loop.
+
+    input() runs in a daemon thread rather than the default executor: a pending read cannot be interrupted,
+    and asyncio.run would otherwise wait for it on shutdown after Ctrl-C.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def read():
+        result, error = None, None
+        try:
+            result = input(prompt)
+        except BaseException as e:
+            error = e
+        try:
+            loop.call_soon_threadsafe(_set_future_result, future, result, error)
+        except RuntimeError:
+            pass  # The loop has already closed.
+
+    threading.Thread(target=read, name="cli-input", daemon=True).start()
+    return await future
+
 
 class CybersecurityRAGApp:
     def __init__(self):
         print("Initializing Cybersecurity RAG System...")
         self.workflow = CybersecurityRAGWorkflow()
         self.current_session_id = None
+        # Whether any answer text was streamed for the current query
+        self._streamed = False
         print("System ready!")
     
     async def initialize(self):
         """Initialize the workflow with async components."""
         await self.workflow.initialize()
+        await self.workflow.warmup()
     
     async def run_cli(self):
         """Run the command line interface."""
@@ -46,7 +101,8 @@ class CybersecurityRAGApp:
             try:
                 # Get user input
                 print("\n" + "-"*40)
-                query = input("🔍 Ask your cybersecurity question: ").strip()
+                # Read stdin off the event loop so it keeps running while the user types
+                query = (await _ainput("🔍 Ask your cybersecurity question: ")).strip()
                 
                 if not query:
                     continue
@@ -62,12 +118,19 @@ class CybersecurityRAGApp:
                 
                 # Process the query - let the system auto-route
                 print("\n🔄 Processing query...")
-                result = await self.workflow.process_query_async(query, session_id=self.current_session_id)
+                print("\n" + "-"*40)
+                self._streamed = False
+                result = await self.workflow.process_query_async(
+                    query, client_config={"configurable": {"thread_id": self.current_session_id}},
+                    on_token=self._print_token
+                )
+                print()
                 
-                # Display results
-                self._display_result(result)
+                # Display results; skip the answer itself if it was already streamed above
+                self._display_result(result, streamed=self._streamed)
                 
-            except KeyboardInterrupt:
+            except (KeyboardInterrupt, EOFError, asyncio.CancelledError):
+                # Under asyncio.run, Ctrl-C arrives as a cancellation of the awaiting coroutine.
                 print("\n\nGoodbye! Stay secure! 🛡️")
                 break
             except Exception as e:
@@ -76,7 +139,7 @@ class CybersecurityRAGApp:
     
     def _start_new_session(self):
         """Start a new conversation session."""
-        self.current_session_id = str(uuid.uuid4())
+        self.current_session_id = new_session_id()
         print(f"\n📝 Starting new conversation (Session ID: {self.current_session_id[:8]}...)")
     
     async def _handle_special_command(self, command: str):
@@ -111,14 +174,11 @@ class CybersecurityRAGApp:
             print("📜 CONVERSATION HISTORY")
             print("="*60)
             
-            for i in range(0, len(state["messages"]), 2):
-                if i + 1 < len(state["messages"]):
-                    user_msg = state["messages"][i]
-                    agent_msg = state["messages"][i + 1]
-                    
-                    print(f"\n👤 You: {user_msg.content}")
-                    print(f"🤖 Assistant: {agent_msg.content}")
-                    print("-" * 40)
+            messages = state["messages"]
+            for user_msg, agent_msg in zip(messages[0::2], messages[1::2]):
+                print(f"\n👤 You: {user_msg.content}")
+                print(f"🤖 Assistant: {agent_msg.content}")
+                print("-" * 40)
             
             print("="*60)
             
@@ -138,25 +198,15 @@ class CybersecurityRAGApp:
         except Exception as e:
             print(f"❌ Error clearing conversation history: {e}")
     
-    def _display_result(self, result: dict):
-        """Display the query result in a formatted way."""
-        # Map agent types to emojis for cleaner display
-        agent_icons = {
-            "incident_response": "🚨",
-            "threat_intelligence": "🕵️", 
-            "prevention": "🛡️",
-            "team_collaboration": "🤝"
-        }
-        
-        agent_names = {
-            "incident_response": "Incident Response Specialist",
-            "threat_intelligence": "Threat Intelligence Analyst",
-            "prevention": "Security Prevention Expert",
-            "team_collaboration": "Cybersecurity Team"
-        }
-        
-        icon = agent_icons.get(result['agent_type'], "🤖")
-        name = agent_names.get(result['agent_type'], result['agent_type'])
+    def _print_token(self, text: str):
+        """Print streamed answer text as soon as it arrives."""
+        self._streamed = True
+        print(text, end="", flush=True)
+
+    def _display_result(self, result: dict, streamed: bool = False):
+        """Display the query result in a formatted way. Skips the answer text if it was already streamed."""
+        icon = _AGENT_ICONS.get(result['agent_type'], "🤖")
+        name = _AGENT_NAMES.get(result['agent_type'], result['agent_type'])
         
         print("\n" + "="*60)
         print("📋 RESPONSE")
@@ -182,13 +232,14 @@ class CybersecurityRAGApp:
             print("\n" + "-"*40)
             print("👥 Individual Expert Perspectives:")
             for agent_type, response in result['agent_responses'].items():
-                agent_icon = agent_icons.get(agent_type, "🤖")
-                print(f"\n{agent_icon} {agent_names.get(agent_type, agent_type)}:")
+                agent_icon = _AGENT_ICONS.get(agent_type, "🤖")
+                print(f"\n{agent_icon} {_AGENT_NAMES.get(agent_type, agent_type)}:")
                 print(response)
             print("-"*40)
         
-        print("\n" + "-"*40)
-        print(result['response'])
+        if not streamed:
+            print("\n" + "-"*40)
+            print(result['response'])
         print("="*60)
     
     async def run_tests(self):
@@ -207,17 +258,18 @@ class CybersecurityRAGApp:
             "What's the best approach to both respond to and prevent future phishing attacks?"
         ]
         
-        for i, query in enumerate(test_queries, 1):
+        # The queries are independent, so let the system auto-route them all concurrently.
+        results = await self.workflow.process_queries_batch(test_queries)
+
+        for i, (query, result) in enumerate(zip(test_queries, results), 1):
             print(f"\n{'='*60}")
             print(f"🧪 TEST {i}/{len(test_queries)}: {query}")
             print("-" * 60)
             
-            try:
-                # Let the system auto-route each query
-                result = await self.workflow.process_query_async(query)
+            if isinstance(result, Exception):
+                print(f"❌ Test failed: {result}")
+            else:
                 self._display_result(result)
-            except Exception as e:
-                print(f"❌ Test failed: {e}")
         
         print(f"\n🎉 Agentic routing tests completed!")
 
@@ -247,6 +299,7 @@ Examples of questions:
 Usage:
   python cli.py           # Start interactive mode
   python cli.py --test    # Test the agentic routing system
+  python cli.py --verbose # Show agent routing and retrieval details
         """
     )
     
@@ -256,6 +309,12 @@ Usage:
         help='Run test queries to verify agentic routing functionality'
     )
     
+    parser.add_argument(
+        '--verbose',
+        action='store_true',
+        help='Show agent routing and retrieval details while processing queries'
+    )
+    
     parser.add_argument(
         '--version', 
         action='version', 
@@ -263,18 +322,22 @@ Usage:
     )
     
     args = parser.parse_args()
+    setup_logging(logging.DEBUG if args.verbose else logging.WARNING)
     
-    # Initialize the application
-    app = CybersecurityRAGApp()
-    await app.initialize()
-    
-    # Handle different modes
-    if args.test:
-        # Run agentic routing tests
-        await app.run_tests()
-    else:
-        # Interactive mode (default)
-        await app.run_cli()
+    try:
+        # Initialize the application
+        app = CybersecurityRAGApp()
+        await app.initialize()
+        
+        # Handle different modes
+        if args.test:
+            # Run agentic routing tests
+            await app.run_tests()
+        else:
+            # Interactive mode (default)
+            await app.run_cli()
+    finally:
+        shutdown_logging()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
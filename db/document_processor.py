@@ -1,13 +1,73 @@
-import json
 import csv
+import functools
+import hashlib
+import ijson
+import itertools
+import logging
+import multiprocessing
+import os
+import pickle
+from concurrent.futures import Future, ProcessPoolExecutor
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Callable, Iterator, Optional, Tuple
+import pypdfium2 as pdfium
 from langchain_community.document_loaders import TextLoader, CSVLoader, JSONLoader, PyPDFLoader
+from langchain_core.document_loaders import BaseLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
 
+logger = logging.getLogger(__name__)
 
-def process_document(file_path:str, file_type:str , chunk_size: int = 1000, chunk_overlap: int = 200) -> List[Document]:
+# Worker processes used to parse PDFs; override with the INGEST_N_THREADS environment variable.
+INGEST_WORKERS = int(os.environ.get("INGEST_N_THREADS", 0)) or max(1, (os.cpu_count() or 2) - 1)
+
+# PDF text extraction backend: "pypdfium2" (PDFium, native code) or "pypdf" (pure Python PyPDFLoader).
+PDF_LOADER = os.environ.get("PDF_LOADER", "pypdfium2")
+
+# Default splitter settings for documents chunked by process_document.
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+
+# Processed (texts, metadatas, ids) per source, reused while the source files are unchanged.
+PROCESSED_CACHE_DIR = Path("data/cache/processed_documents")
+# Part of every cache key; bump it when processing changes in a way the key does not otherwise capture.
+PROCESSED_CACHE_VERSION = 1
+
+ProcessedDocuments = tuple[List[str], List[Dict[str, Any]], List[str]]
+
+
+class PdfiumLoader(BaseLoader):
+    """Load a PDF one Document per page with PDFium; same metadata as PyPDFLoader (source, page)."""
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+
+    def load(self) -> List[Document]:
+        pdf = pdfium.PdfDocument(self.file_path)
+        try:
+            documents = []
+            for page_number in range(len(pdf)):
+                page = pdf[page_number]
+                text_page = page.get_textpage()
+                documents.append(Document(
+                    page_content=text_page.get_text_range(),
+                    metadata={"source": self.file_path, "page": page_number}
+                ))
+                text_page.close()
+                page.close()
+            return documents
+        finally:
+            pdf.close()
+
+@functools.lru_cache(maxsize=8)
+def _get_splitter(chunk_size: int, chunk_overlap: int) -> RecursiveCharacterTextSplitter:
+    """Build each splitter configuration once per process and reuse it for every document."""
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap
+    )
+
+def process_document(file_path:str, file_type:str , chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP) -> List[Document]:
     """
     Process various document types and split them into manageable chunks.
     
@@ -34,21 +94,31 @@ def process_document(file_path:str, file_type:str , chunk_size: int = 1000, chun
     elif file_type == "json":
         loader = JSONLoader(file_path)
     elif file_type == "pdf":
-        loader = PyPDFLoader(file_path)
+        loader = PdfiumLoader(file_path) if PDF_LOADER == "pypdfium2" else PyPDFLoader(file_path)
     else:
         raise ValueError(f"Unsupported file type: {file_type}")
     try:
         documents = loader.load()
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=chunk_size,
-            chunk_overlap=chunk_overlap
-        )
-        chunks = text_splitter.split_documents(documents)
+        chunks = _get_splitter(chunk_size, chunk_overlap).split_documents(documents)
     except Exception as e:
         raise ValueError(f"Error processing document: {e}")
 
     return chunks
 
+def _load_pdf_chunks(pdf_path: str) -> List[Tuple[str, Dict[str, Any]]]:
+    """Parse and split one PDF into (content, metadata) pairs. Module-level so worker processes can run it."""
+    return [(chunk.page_content, chunk.metadata) for chunk in process_document(file_path=pdf_path, file_type="pdf")]
+
+def _load_pdfs(pdf_files: List[Path]) -> Iterator[Tuple[Path, Future]]:
+    """Parse PDFs in a process pool, yielding each file with its pending chunks in input order."""
+    if not pdf_files:
+        return
+    # Spawned workers start clean instead of forking a parent that may hold threads, locks, or open connections.
+    with ProcessPoolExecutor(max_workers=min(INGEST_WORKERS, len(pdf_files)),
+                             mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = [executor.submit(_load_pdf_chunks, str(pdf_file)) for pdf_file in pdf_files]
+        yield from zip(pdf_files, futures)
+
 def _process_prevention_pdfs(prevention_dir_path: Path) -> tuple[List[str], List[Dict[str, Any]], List[str]]:
     """Process Prevention Framework PDF documents."""
     doc_texts = []
@@ -63,16 +133,12 @@ def _process_prevention_pdfs(prevention_dir_path: Path) -> tuple[List[str], List
 
     print(f"Processing Prevention documents from: {prevention_dir_path}")
     
-    for pdf_file in prevention_dir_path.glob("*.pdf"):
+    for pdf_file, pending_chunks in _load_pdfs(list(prevention_dir_path.glob("*.pdf"))):
         try:
-            langchain_chunks = process_document(
-                file_path=str(pdf_file), 
-                file_type="pdf"
-            )
-            for i, chunk_doc in enumerate(langchain_chunks):
-                doc_texts.append(chunk_doc.page_content)
+            for i, (page_content, chunk_metadata) in enumerate(pending_chunks.result()):
+                doc_texts.append(page_content)
                 meta = {
-                    **chunk_doc.metadata,
+                    **chunk_metadata,
                     "agent_type": "prevention",
                     "doc_type": "framework_guide",
                     "source": pdf_file.name,
@@ -102,16 +168,12 @@ def _process_incident_response_pdfs(ir_dir_path: Path) -> tuple[List[str], List[
 
     print(f"Processing Incident Response documents from: {ir_dir_path}")
     
-    for pdf_file in ir_dir_path.glob("*.pdf"):
+    for pdf_file, pending_chunks in _load_pdfs(list(ir_dir_path.glob("*.pdf"))):
         try:
-            langchain_chunks = process_document(
-                file_path=str(pdf_file),
-                file_type="pdf"
-            )
-            for i, chunk_doc in enumerate(langchain_chunks):
-                doc_texts.append(chunk_doc.page_content)
+            for i, (page_content, chunk_metadata) in enumerate(pending_chunks.result()):
+                doc_texts.append(page_content)
                 meta = {
-                    **chunk_doc.metadata,
+                    **chunk_metadata,
                     "agent_type": "incident_response",
                     "doc_type": "playbook",
                     "source": pdf_file.name,
@@ -142,37 +204,36 @@ def _process_mitre_attack_data(mitre_file_path: Path) -> tuple[List[str], List[D
     print(f"Processing MITRE ATT&CK data from: {mitre_file_path.name}")
     
     try:
-        with open(mitre_file_path, 'r', encoding='utf-8') as f:
-            mitre_data = json.load(f)
-        
-        for obj in mitre_data.get('objects', []):
-            if obj.get('type') == 'attack-pattern':
-                technique_id = "Unknown"
-                for ref in obj.get('external_references', []):
-                    if ref.get('source_name') == 'mitre-attack':
-                        technique_id = ref.get('external_id', 'Unknown')
-                        break
+        # Stream STIX objects one at a time instead of loading the whole bundle into memory.
+        with open(mitre_file_path, 'rb') as f:
+            for obj in ijson.items(f, 'objects.item', use_float=True):
+                if obj.get('type') == 'attack-pattern':
+                    technique_id = "Unknown"
+                    for ref in obj.get('external_references', []):
+                        if ref.get('source_name') == 'mitre-attack':
+                            technique_id = ref.get('external_id', 'Unknown')
+                            break
                 
-                name = obj.get('name', '')
-                description = obj.get('description', '')
-                description = description.replace('\r\n', '\n').strip()
+                    name = obj.get('name', '')
+                    description = obj.get('description', '')
+                    description = description.replace('\r\n', '\n').strip()
 
-                text_content = f"MITRE ATT&CK Technique {technique_id}: {name}\n{description}"
-                doc_texts.append(text_content)
+                    text_content = f"MITRE ATT&CK Technique {technique_id}: {name}\n{description}"
+                    doc_texts.append(text_content)
                 
-                meta = {
-                    "agent_type": "shared",
-                    "doc_type": "technique",
-                    "framework": "mitre_attack",
-                    "technique_id": technique_id,
-                    "source": mitre_file_path.name 
-                }
-                metadatas_list.append(meta)
+                    meta = {
+                        "agent_type": "shared",
+                        "doc_type": "technique",
+                        "framework": "mitre_attack",
+                        "technique_id": technique_id,
+                        "source": mitre_file_path.name 
+                    }
+                    metadatas_list.append(meta)
                 
-                mitre_id = f"mitre_{technique_id.replace('.', '_').replace('-', '_')}"
-                ids_list.append(mitre_id)
+                    mitre_id = f"mitre_{technique_id.replace('.', '_').replace('-', '_')}"
+                    ids_list.append(mitre_id)
 
-    except json.JSONDecodeError as e:
+    except ijson.JSONError as e:
         raise ValueError(f"Invalid JSON in MITRE ATT&CK file {mitre_file_path.name}: {e}") from e
     except Exception as e:
         raise RuntimeError(f"Unexpected error processing MITRE ATT&CK data: {e}") from e
@@ -192,21 +253,20 @@ def _process_emerging_threats_ips(file_path: Path) -> tuple[List[str], List[Dict
         raise ValueError(f"Emerging Threats IP path {file_path} is not a file.")
 
     try:
-        langchain_chunks = process_document(
-            file_path=str(file_path),
-            file_type="text"
-        )
-        for i, chunk_doc in enumerate(langchain_chunks):
-            ip_address = chunk_doc.page_content.strip()
+        # The blocklist is one IP per line, so read lines directly instead of loading and chunking it.
+        # Filtering on raw bytes means only the surviving address lines are decoded.
+        lines = file_path.read_bytes().splitlines()
+        for i, line in enumerate(lines):
+            line = line.strip()
             
-            if not ip_address or ip_address.startswith("#") or '.' not in ip_address:
+            if not line or line[:1] == b"#" or b"." not in line:
                 continue
                 
+            ip_address = line.decode('utf-8', errors='ignore')
             text_content = f"Blocked IP Address: {ip_address}"
             doc_texts.append(text_content)
             
             meta = {
-                **chunk_doc.metadata, 
                 "agent_type": "threat_intelligence",
                 "doc_type": "ioc",
                 "indicator_type": "ip_address",
@@ -225,6 +285,25 @@ def _process_emerging_threats_ips(file_path: Path) -> tuple[List[str], List[Dict
     
     return doc_texts, metadatas_list, ids_list
 
+def _iter_json_array(f, path: str, file_name: str) -> Iterator[Any]:
+    """Stream the items of the JSON array at path ("" for the top level, dot-separated keys below it).
+
+    Raises ValueError if the value at path is not an array, or a value on the way to it is not an object,
+    so a file with the wrong shape fails instead of silently yielding nothing.
+    """
+    keys = path.split(".") if path else []
+    parents = {".".join(keys[:depth]) for depth in range(len(keys))}
+
+    def checked_events():
+        for prefix, event, value in ijson.parse(f, use_float=True):
+            if prefix == path and event not in ("start_array", "end_array"):
+                raise ValueError(f"Expected a list at '{path or '<root>'}' in {file_name}, but found {event}")
+            if prefix in parents and event not in ("start_map", "map_key", "end_map"):
+                raise ValueError(f"Expected an object at '{prefix or '<root>'}' in {file_name}, but found {event}")
+            yield prefix, event, value
+
+    return ijson.items(checked_events(), f"{path}.item" if path else "item")
+
 def _process_feodo_tracker_ips(file_path: Path) -> tuple[List[str], List[Dict[str, Any]], List[str]]:
     """Process Feodo Tracker IP blocklist from JSON file."""
     doc_texts = []
@@ -238,48 +317,43 @@ def _process_feodo_tracker_ips(file_path: Path) -> tuple[List[str], List[Dict[st
         raise ValueError(f"Feodo Tracker IP path {file_path} is not a file.")
 
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            ip_data_list = json.load(f)
-        
-        if not isinstance(ip_data_list, list):
-            raise ValueError(f"Expected a list of IPs in {file_path.name}, but got {type(ip_data_list)}")
-        
-        for i, ip_info in enumerate(ip_data_list):
-            ip_address = ip_info.get('ip_address')
-            if not ip_address: 
-                continue
+        with open(file_path, 'rb') as f:
+            for i, ip_info in enumerate(_iter_json_array(f, '', file_path.name)):
+                ip_address = ip_info.get('ip_address')
+                if not ip_address: 
+                    continue
 
-            malware_family = ip_info.get('malware', 'Unknown')
-            status = ip_info.get('status', 'Unknown')
-            hostname = ip_info.get('hostname', 'N/A')
-            country = ip_info.get('country', 'N/A')
-            first_seen = ip_info.get('first_seen_utc', 'N/A')
-
-            text_content = (
-                f"Malicious IP (Feodo Tracker): {ip_address}, "
-                f"Hostname: {hostname}, Malware family: {malware_family}, "
-                f"Status: {status}, Country: {country}, First seen (UTC): {first_seen}"
-            )
-            doc_texts.append(text_content)
+                malware_family = ip_info.get('malware', 'Unknown')
+                status = ip_info.get('status', 'Unknown')
+                hostname = ip_info.get('hostname', 'N/A')
+                country = ip_info.get('country', 'N/A')
+                first_seen = ip_info.get('first_seen_utc', 'N/A')
+
+                text_content = (
+                    f"Malicious IP (Feodo Tracker): {ip_address}, "
+                    f"Hostname: {hostname}, Malware family: {malware_family}, "
+                    f"Status: {status}, Country: {country}, First seen (UTC): {first_seen}"
+                )
+                doc_texts.append(text_content)
             
-            meta = {
-                "agent_type": "threat_intelligence",
-                "doc_type": "ioc",
-                "indicator_type": "ip_address",
-                "source": file_path.name,
-                "raw_indicator": ip_address,
-                "hostname": hostname,
-                "malware_family": malware_family,
-                "ip_status": status,
-                "country": country,
-                "first_seen_utc": first_seen
-            }
-            metadatas_list.append(meta)
+                meta = {
+                    "agent_type": "threat_intelligence",
+                    "doc_type": "ioc",
+                    "indicator_type": "ip_address",
+                    "source": file_path.name,
+                    "raw_indicator": ip_address,
+                    "hostname": hostname,
+                    "malware_family": malware_family,
+                    "ip_status": status,
+                    "country": country,
+                    "first_seen_utc": first_seen
+                }
+                metadatas_list.append(meta)
             
-            feodo_id = f"feodo_ip_{ip_address.replace('.', '_')}_{i}"
-            ids_list.append(feodo_id)
+                feodo_id = f"feodo_ip_{ip_address.replace('.', '_')}_{i}"
+                ids_list.append(feodo_id)
 
-    except json.JSONDecodeError as e:
+    except ijson.JSONError as e:
         raise ValueError(f"Invalid JSON in Feodo Tracker file {file_path.name}: {e}") from e
     except Exception as e:
         raise RuntimeError(f"Unexpected error processing {file_path.name}: {e}") from e
@@ -299,60 +373,53 @@ def _process_cisa_vulnerabilities(file_path: Path) -> tuple[List[str], List[Dict
         raise ValueError(f"CISA KEV path {file_path} is not a file.")
 
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            cisa_data = json.load(f)
-        
-        vulnerabilities_list = cisa_data.get('vulnerabilities', [])
-        
-        if not isinstance(vulnerabilities_list, list):
-            raise ValueError(f"Expected a list under 'vulnerabilities' key in {file_path.name}, but found {type(vulnerabilities_list)}")
-        
-        for i, vuln in enumerate(vulnerabilities_list):
-            cve_id = vuln.get('cveID')
-            if not cve_id:
-                continue
+        with open(file_path, 'rb') as f:
+            for i, vuln in enumerate(_iter_json_array(f, 'vulnerabilities', file_path.name)):
+                cve_id = vuln.get('cveID')
+                if not cve_id:
+                    continue
 
-            name = vuln.get('vulnerabilityName', 'N/A')
-            description = vuln.get('shortDescription', 'N/A')
-            date_added = vuln.get('dateAdded', 'N/A')
-            ransomware_use = vuln.get('knownRansomwareUse', 'N/A')
-            due_date = vuln.get('dueDate', 'N/A') 
-            notes = vuln.get('notes', 'N/A')
-
-            text_content = (
-                f"CISA KEV: {cve_id} - {name}. Description: {description}. "
-                f"Date Added: {date_added}. Known Ransomware Use: {ransomware_use}. "
-                f"Due Date (Federal): {due_date}."
-                f"{(' Notes: ' + notes) if notes != 'N/A' and notes else ''}"
-            )
-            doc_texts.append(text_content)
+                name = vuln.get('vulnerabilityName', 'N/A')
+                description = vuln.get('shortDescription', 'N/A')
+                date_added = vuln.get('dateAdded', 'N/A')
+                ransomware_use = vuln.get('knownRansomwareUse', 'N/A')
+                due_date = vuln.get('dueDate', 'N/A') 
+                notes = vuln.get('notes', 'N/A')
+
+                text_content = (
+                    f"CISA KEV: {cve_id} - {name}. Description: {description}. "
+                    f"Date Added: {date_added}. Known Ransomware Use: {ransomware_use}. "
+                    f"Due Date (Federal): {due_date}."
+                    f"{(' Notes: ' + notes) if notes != 'N/A' and notes else ''}"
+                )
+                doc_texts.append(text_content)
             
-            meta = {
-                "agent_type": "threat_intelligence",
-                "doc_type": "vulnerability",
-                "indicator_type": "cve_id", 
-                "source": file_path.name,
-                "cve_id": cve_id,
-                "vulnerability_name": name,
-                "date_added": date_added,
-                "known_ransomware_use": ransomware_use,
-                "due_date": due_date,
-                "notes": notes
-            }
-            metadatas_list.append(meta)
+                meta = {
+                    "agent_type": "threat_intelligence",
+                    "doc_type": "vulnerability",
+                    "indicator_type": "cve_id", 
+                    "source": file_path.name,
+                    "cve_id": cve_id,
+                    "vulnerability_name": name,
+                    "date_added": date_added,
+                    "known_ransomware_use": ransomware_use,
+                    "due_date": due_date,
+                    "notes": notes
+                }
+                metadatas_list.append(meta)
             
-            cisa_id = f"cisa_kev_{cve_id.replace('-', '_').upper()}"
-            ids_list.append(cisa_id)
+                cisa_id = f"cisa_kev_{cve_id.replace('-', '_').upper()}"
+                ids_list.append(cisa_id)
 
-    except json.JSONDecodeError as e:
+    except ijson.JSONError as e:
         raise ValueError(f"Invalid JSON in CISA KEV file {file_path.name}: {e}") from e
     except Exception as e:
         raise RuntimeError(f"Unexpected error processing {file_path.name}: {e}") from e
     
     return doc_texts, metadatas_list, ids_list
 
-def _process_urlhaus_links(file_path: Path) -> tuple[List[str], List[Dict[str, Any]], List[str]]:
-    """Process URLHaus malicious URL links from CSV file."""
+def _process_urlhaus_links(file_path: Path, max_rows: Optional[int] = None) -> tuple[List[str], List[Dict[str, Any]], List[str]]:
+    """Process URLHaus malicious URL links from CSV file. max_rows caps the data rows read; None reads them all."""
     doc_texts = []
     metadatas_list = []
     ids_list = []
@@ -365,33 +432,22 @@ def _process_urlhaus_links(file_path: Path) -> tuple[List[str], List[Dict[str, A
 
     try:
         with open(file_path, 'r', encoding='utf-8', newline='') as f:
-            actual_content_pos = 0
-            while True:
-                line = f.readline()
-                if not line: 
-                    break 
-                if line.startswith('#'):
-                    actual_content_pos = f.tell() 
-                else:
-                    f.seek(actual_content_pos) 
-                    break
-            
-            reader = csv.DictReader(f)
-            for i, row in enumerate(reader):
-                # Limit to 5000 entries for testing purposes
-                if len(doc_texts) >= 5000:
-                    print("Reached limit of 5000 URLHaus entries for testing")
-                    break
-                entry_id = row.get('# id', row.get('id'))
+            # Drop comment lines while reading, keeping the feed's commented "# id,..." column header.
+            reader = csv.reader(line for line in f if not line.startswith('#') or line.startswith('# id'))
+            header = next(reader, [])
+            # Resolve column positions once instead of building a dict for every row.
+            column_index = {name: idx for idx, name in enumerate(header)}
+            id_idx = column_index.get('# id', column_index.get('id'))
+            field_idxs = [column_index.get(name) for name in ('url', 'threat', 'tags', 'dateadded', 'url_status', 'reporter')]
+
+            for row in itertools.islice(reader, max_rows):
+                entry_id = row[id_idx] if id_idx is not None and id_idx < len(row) else None
                 if not entry_id:
                     continue
 
-                url = row.get('url', 'N/A')
-                threat_type = row.get('threat', 'N/A')
-                tags = row.get('tags', 'N/A')
-                date_added = row.get('dateadded', 'N/A')
-                url_status = row.get('url_status', 'N/A')
-                reporter = row.get('reporter', 'N/A')
+                url, threat_type, tags, date_added, url_status, reporter = (
+                    row[idx] if idx is not None and idx < len(row) else 'N/A' for idx in field_idxs
+                )
 
                 text_content = (
                     f"Malicious URL (URLHaus): {url}, Threat: {threat_type}, "
@@ -425,12 +481,41 @@ def _process_urlhaus_links(file_path: Path) -> tuple[List[str], List[Dict[str, A
     
     return doc_texts, metadatas_list, ids_list
 
-def _process_threat_intelligence_data(threat_dir_path: Path) -> tuple[List[str], List[Dict[str, Any]], List[str]]:
-    """Process all threat intelligence data sources."""
-    all_doc_texts = []
-    all_metadatas = []
-    all_ids = []
+def _source_fingerprint(source_path: Path) -> List[Tuple[str, int, int]]:
+    """(path, size, mtime) of the files a source is built from: the PDFs of a directory, or the file itself."""
+    files = sorted(source_path.glob("*.pdf")) if source_path.is_dir() else [source_path]
+    return [(str(path), stat.st_size, stat.st_mtime_ns) for path in files for stat in (path.stat(),)]
+
+def _cached_process(process_fn: Callable[..., ProcessedDocuments], source_path: Path, use_cache: bool = True, **kwargs) -> ProcessedDocuments:
+    """Run process_fn on source_path, reusing the pickled result of an earlier run if its files are unchanged.
 
+    Extra keyword arguments are passed to process_fn and are part of the cache key, along with the PDF loader,
+    the chunking settings and PROCESSED_CACHE_VERSION.
+    """
+    if not use_cache or not source_path.exists():
+        return process_fn(source_path, **kwargs)
+
+    key_material = repr((
+        PROCESSED_CACHE_VERSION, process_fn.__name__, sorted(kwargs.items()),
+        PDF_LOADER, CHUNK_SIZE, CHUNK_OVERLAP, _source_fingerprint(source_path)
+    ))
+    cache_file = PROCESSED_CACHE_DIR / f"{hashlib.sha1(key_material.encode('utf-8')).hexdigest()}.pkl"
+    if cache_file.exists():
+        logger.info("Using cached processed documents for %s", source_path.name)
+        with open(cache_file, 'rb') as f:
+            return pickle.load(f)
+
+    result = process_fn(source_path, **kwargs)
+    PROCESSED_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_file = cache_file.with_suffix(".tmp")
+    with open(tmp_file, 'wb') as f:
+        pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_file, cache_file)
+    return result
+
+def _iter_threat_intelligence_data(threat_dir_path: Path, use_cache: bool = True,
+                                   urlhaus_max_rows: Optional[int] = None) -> Iterator[ProcessedDocuments]:
+    """Process each threat intelligence data source in turn."""
     if not threat_dir_path.exists():
         raise FileNotFoundError(f"Threat Intelligence directory {threat_dir_path} does not exist.")
     
@@ -439,41 +524,47 @@ def _process_threat_intelligence_data(threat_dir_path: Path) -> tuple[List[str],
 
     print(f"\nProcessing Threat Intelligence data from: {threat_dir_path}")
 
-    # Process each threat intelligence source
-    emerging_texts, emerging_metas, emerging_ids = _process_emerging_threats_ips(threat_dir_path / "emerging-Block-IPs.txt")
-    all_doc_texts.extend(emerging_texts)
-    all_metadatas.extend(emerging_metas)
-    all_ids.extend(emerging_ids)
-
-    feodo_texts, feodo_metas, feodo_ids = _process_feodo_tracker_ips(threat_dir_path / "ipblocklist.json")
-    all_doc_texts.extend(feodo_texts)
-    all_metadatas.extend(feodo_metas)
-    all_ids.extend(feodo_ids)
-
-    cisa_texts, cisa_metas, cisa_ids = _process_cisa_vulnerabilities(threat_dir_path / "known_exploited_vulnerabilities.json")
-    all_doc_texts.extend(cisa_texts)
-    all_metadatas.extend(cisa_metas)
-    all_ids.extend(cisa_ids)
-
-    urlhaus_texts, urlhaus_metas, urlhaus_ids = _process_urlhaus_links(threat_dir_path / "urlhaus_links.csv")
-    all_doc_texts.extend(urlhaus_texts)
-    all_metadatas.extend(urlhaus_metas)
-    all_ids.extend(urlhaus_ids)
-    
-    mitre_texts, mitre_metas, mitre_ids = _process_mitre_attack_data(threat_dir_path  / "mitre-enterprise-attack.json")
-    all_doc_texts.extend(mitre_texts)
-    all_metadatas.extend(mitre_metas)
-    all_ids.extend(mitre_ids)
-    
-    return all_doc_texts, all_metadatas, all_ids
+    yield _cached_process(_process_emerging_threats_ips, threat_dir_path / "emerging-Block-IPs.txt", use_cache)
+    yield _cached_process(_process_feodo_tracker_ips, threat_dir_path / "ipblocklist.json", use_cache)
+    yield _cached_process(_process_cisa_vulnerabilities, threat_dir_path / "known_exploited_vulnerabilities.json", use_cache)
+    yield _cached_process(_process_urlhaus_links, threat_dir_path / "urlhaus_links.csv", use_cache, max_rows=urlhaus_max_rows)
+    yield _cached_process(_process_mitre_attack_data, threat_dir_path / "mitre-enterprise-attack.json", use_cache)
+
+def iter_processed_sources(data_dir: str = "data/documents", use_cache: bool = True,
+                           urlhaus_max_rows: Optional[int] = None) -> Iterator[ProcessedDocuments]:
+    """
+    Processes the documents from the data directory one source at a time, 
+    so consumers can start on a source before the later ones are parsed.
+
+    Args:
+        data_dir (str): The root directory containing the raw data.
+        use_cache (bool): Reuse processed results of unchanged sources from PROCESSED_CACHE_DIR.
+        urlhaus_max_rows (Optional[int]): Read at most this many URLHaus rows; None reads the whole feed.
 
-def process_all_documents(data_dir: str = "data/documents") -> tuple[List[str], List[Dict[str, Any]], List[str]]:
+    Yields:
+        ProcessedDocuments: The document contents, metadatas, and ids of one source.
+    """
+    data_path = Path(data_dir)
+
+    # Prevention Framework documents
+    yield _cached_process(_process_prevention_pdfs, data_path / "framework_basics", use_cache)
+
+    # Incident Response Playbooks
+    yield _cached_process(_process_incident_response_pdfs, data_path / "incident_response", use_cache)
+
+    # Threat Intelligence data
+    yield from _iter_threat_intelligence_data(data_path / "threat_intelligence", use_cache, urlhaus_max_rows)
+
+def process_all_documents(data_dir: str = "data/documents", use_cache: bool = True,
+                          urlhaus_max_rows: Optional[int] = None) -> tuple[List[str], List[Dict[str, Any]], List[str]]:
     """
     Processes all specified documents from the data directory, 
     chunks them, and prepares them for database ingestion.
 
     Args:
         data_dir (str): The root directory containing the raw data.
+        use_cache (bool): Reuse processed results of unchanged sources from PROCESSED_CACHE_DIR.
+        urlhaus_max_rows (Optional[int]): Read at most this many URLHaus rows; None reads the whole feed.
 
     Returns:
         tuple[List[str], List[Dict[str, Any]], List[str]]: 
@@ -483,28 +574,10 @@ def process_all_documents(data_dir: str = "data/documents") -> tuple[List[str],
     all_metadatas = []
     all_ids = []
 
-    data_path = Path(data_dir)
-
-    # Process Prevention Framework documents
-    prevention_texts, prevention_metas, prevention_ids = _process_prevention_pdfs(data_path / "framework_basics")
-    all_doc_texts.extend(prevention_texts)
-    all_metadatas.extend(prevention_metas)
-    all_ids.extend(prevention_ids)
-
-    # Process Incident Response Playbooks
-    ir_texts, ir_metas, ir_ids = _process_incident_response_pdfs(data_path / "incident_response")
-    all_doc_texts.extend(ir_texts)
-    all_metadatas.extend(ir_metas)
-    all_ids.extend(ir_ids)
-
-    # Process Threat Intelligence data
-    threat_texts, threat_metas, threat_ids = _process_threat_intelligence_data(data_path / "threat_intelligence")
-    all_doc_texts.extend(threat_texts)
-    all_metadatas.extend(threat_metas)
-    all_ids.extend(threat_ids)
+    for texts, metadatas, ids in iter_processed_sources(data_dir, use_cache, urlhaus_max_rows):
+        all_doc_texts.extend(texts)
+        all_metadatas.extend(metadatas)
+        all_ids.extend(ids)
 
     print(f"Finished processing all documents. Total texts: {len(all_doc_texts)}, Metadatas: {len(all_metadatas)}, IDs: {len(all_ids)}")
     return all_doc_texts, all_metadatas, all_ids
- 
- 
-    
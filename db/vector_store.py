@@ -1,11 +1,42 @@
 from langchain_chroma import Chroma
 from langchain_huggingface import HuggingFaceEmbeddings
-from .document_processor import process_all_documents
+from .document_processor import iter_processed_sources
 from pathlib import Path
+from typing import List, Optional, Tuple
 import asyncio
+import functools
+from collections import OrderedDict
+import logging
+import os
+import queue
+import threading
 import torch
 
+logger = logging.getLogger(__name__)
+
+# Number of distinct query strings whose embeddings are kept in memory.
+EMBEDDING_CACHE_SIZE = 4096
+# Number of (query, agent_type, k) search results kept in memory; cleared whenever the store is repopulated.
+SEARCH_CACHE_SIZE = 1024
+# Documents embedded and written to Chroma per round trip during ingestion (below Chroma's max batch size).
+INGEST_BATCH_SIZE = 5000
+# Parsed batches allowed to wait for the embedder before document processing pauses.
+INGEST_QUEUE_DEPTH = 4
+# Seconds a producer waits on a full queue before checking whether the consumer has stopped.
+INGEST_PUT_TIMEOUT = 1.0
+# HNSW settings applied when the collection is created. New vectors sit in a brute-force buffer until
+# batch_size of them accumulate and are then indexed in one pass; the index is written to disk every
+# sync_threshold additions. This trades a larger memory spike during bulk ingestion for far fewer
+# incremental index updates and flushes.
+HNSW_COLLECTION_METADATA = {
+    "hnsw:batch_size": 10000,
+    "hnsw:sync_threshold": 100000,
+}
+
 device = "cuda" if torch.cuda.is_available() else "cpu"
+# On CUDA the embedding model runs in FP16 and is compiled with torch.compile; set EMBEDDING_COMPILE=0 to
+# skip compilation (e.g. where Triton is unavailable). CPU always runs the FP32 model as loaded.
+EMBEDDING_COMPILE = os.environ.get("EMBEDDING_COMPILE", "1") == "1"
 
 class DatabaseManager:
     """Manages vector database operations including creation, population, and testing."""
@@ -28,7 +59,22 @@ class DatabaseManager:
                 'batch_size': 128 if device == "cuda" else 32, 
             },
         )
+        if device == "cuda":
+            self._optimize_embedding_model()
+        self._embed_query_cached = functools.lru_cache(maxsize=EMBEDDING_CACHE_SIZE)(self._embed_query_uncached)
+        self._search_cache: "OrderedDict[tuple, List[dict]]" = OrderedDict()
+        self._search_cache_lock = threading.Lock()
     
+    def _optimize_embedding_model(self):
+        """Cast the GPU embedding model to FP16 and compile its transformer for faster forward passes."""
+        model = self.embeddings.client
+        model.half()
+        if EMBEDDING_COMPILE:
+            transformer = model[0]
+            # Batches are padded to their longest text, so sequence lengths vary; dynamic shapes avoid a
+            # recompile for every new length.
+            transformer.auto_model = torch.compile(transformer.auto_model, dynamic=True)
+
     def _create_vector_store(self) -> Chroma:
         """Create and return a Chroma vector store with BAAI/Bge-large-en-v1.5 embeddings."""
         try:
@@ -37,38 +83,98 @@ class DatabaseManager:
             
             vector_store = Chroma(
                 persist_directory=str(self.persist_directory),
-                embedding_function=self.embeddings
+                collection_name=self.collection_name,
+                embedding_function=self.embeddings,
+                collection_metadata=HNSW_COLLECTION_METADATA
             )
             return vector_store
         except Exception as e:
             raise ValueError(f"Error creating vector store: {e}")
 
-    def populate_database(self):
-        """Populate the vector store with processed documents."""
+    @staticmethod
+    def _produce_batches(batches: queue.Queue, stop: threading.Event, use_cache: bool,
+                         urlhaus_max_rows: Optional[int] = None):
+        """Parse the sources and queue them, first occurrence of each id only, in INGEST_BATCH_SIZE slices.
+
+        The queue ends with None, or with the error that stopped processing. Once stop is set the producer
+        gives up instead of waiting for room in the queue.
+        """
+        def put(item) -> bool:
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=INGEST_PUT_TIMEOUT)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        try:
+            texts, metadatas, ids = [], [], []
+            # Chroma rejects a batch with repeated ids, and a later duplicate would only overwrite the first.
+            seen_ids = set()
+            for source_texts, source_metadatas, source_ids in iter_processed_sources(use_cache=use_cache, urlhaus_max_rows=urlhaus_max_rows):
+                for text, metadata, doc_id in zip(source_texts, source_metadatas, source_ids):
+                    if doc_id in seen_ids:
+                        continue
+                    seen_ids.add(doc_id)
+                    texts.append(text)
+                    metadatas.append(metadata)
+                    ids.append(doc_id)
+                while len(texts) >= INGEST_BATCH_SIZE:
+                    if not put((texts[:INGEST_BATCH_SIZE], metadatas[:INGEST_BATCH_SIZE], ids[:INGEST_BATCH_SIZE])):
+                        return
+                    del texts[:INGEST_BATCH_SIZE], metadatas[:INGEST_BATCH_SIZE], ids[:INGEST_BATCH_SIZE]
+            if texts and not put((texts, metadatas, ids)):
+                return
+        except Exception as e:
+            put(e)
+            return
+        put(None)
+
+    def populate_database(self, use_cache: bool = True, urlhaus_max_rows: Optional[int] = None):
+        """Populate the vector store with processed documents.
+
+        use_cache=False re-parses every source; urlhaus_max_rows caps the URLHaus rows ingested (None for all).
+        """
         try:
             print("Processing all documents for vector store population...")
             
-            # Get processed documents
-            all_documents, all_metadatas, all_ids = process_all_documents()
+            # Documents are parsed on a producer thread while this thread embeds and stores the
+            # batches already parsed; embed_documents batches the model calls itself.
+            batches: queue.Queue = queue.Queue(maxsize=INGEST_QUEUE_DEPTH)
+            # Set when this thread stops consuming, so a producer blocked on a full queue exits too.
+            stop = threading.Event()
+            producer = threading.Thread(target=self._produce_batches, args=(batches, stop, use_cache, urlhaus_max_rows), daemon=True)
+            producer.start()
+
+            try:
+                self.vector_store = self._create_vector_store()
+                collection = self.vector_store._collection
+                stored = 0
+                while (batch := batches.get()) is not None:
+                    if isinstance(batch, Exception):
+                        raise batch
+                    batch_texts, batch_metadatas, batch_ids = batch
+                    collection.upsert(
+                        ids=batch_ids,
+                        embeddings=self.embeddings.embed_documents(batch_texts),
+                        documents=batch_texts,
+                        metadatas=batch_metadatas
+                    )
+                    stored += len(batch_texts)
+                    print(f"Stored {stored} documents")
+            finally:
+                stop.set()
+            producer.join()
+            with self._search_cache_lock:
+                self._search_cache.clear()
             
-            if not all_documents:
+            if not stored:
                 print("No documents to add to the vector store.")
                 return False
-                
-            print(f"Creating vector store from {len(all_documents)} documents...")
-            
-            # Create vector store from documents
-            self.vector_store = Chroma.from_texts(
-                texts=all_documents,
-                metadatas=all_metadatas,
-                embedding=self.embeddings,
-                persist_directory=str(self.persist_directory),
-                collection_name=self.collection_name,
-                ids=all_ids
-            )
             
             # Note: Chroma automatically persists when persist_directory is specified
-            print(f"Vector store populated with {len(all_documents)} documents")
+            print(f"Vector store populated with {stored} documents")
             return True
             
         except Exception as e:
@@ -83,19 +189,39 @@ class DatabaseManager:
             self.vector_store = self._create_vector_store()
         return self.vector_store
     
-    def setup_database(self):
+    def setup_database(self, use_cache: bool = True, urlhaus_max_rows: Optional[int] = None):
         """Setup and populate the vector database."""
         print("Setting up cybersecurity knowledge database...")
         
-        if self.populate_database():
+        if self.populate_database(use_cache=use_cache, urlhaus_max_rows=urlhaus_max_rows):
             print("Vector store populated successfully!")
             return True
         else:
             print("Failed to populate vector store.")
             return False
     
-    def _perform_search(self, query: str, agent_type: str = None, k: int = 5):
-        """Internal method to perform the actual search with filtering."""
+    def _embed_query_uncached(self, query: str) -> Tuple[float, ...]:
+        return tuple(self.embeddings.embed_query(query))
+
+    def embed_query(self, query: str) -> List[float]:
+        """Embed a query with the same model used for the stored documents.
+
+        Embeddings are memoized per query string, so repeated queries skip the model.
+        """
+        return list(self._embed_query_cached(query))
+
+    async def aembed_query(self, query: str) -> List[float]:
+        """Async wrapper for embed_query."""
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, lambda: self.embed_query(query))
+
+    def _perform_search_batch(self, queries: List[str], agent_type: str = None, k: int = 5,
+                              embeddings: Optional[List[List[float]]] = None) -> List[List[dict]]:
+        """Internal method to search for several queries at once, with filtering.
+
+        All queries share one embedding call and one collection query. Precomputed embeddings are used
+        directly when given; a single query is embedded through the cache.
+        """
         if not self.vector_store:
             self.vector_store = self.get_vector_store()
         
@@ -103,37 +229,63 @@ class DatabaseManager:
         where_filter = {"agent_type": agent_type} if agent_type else None
         
         try:
-            results = self.vector_store.similarity_search_with_score(
-                query=query,
-                k=k,
-                filter=where_filter
+            if embeddings is None:
+                embeddings = [self.embed_query(queries[0])] if len(queries) == 1 else self.embeddings.embed_documents(queries)
+            results = self.vector_store._collection.query(
+                query_embeddings=embeddings,
+                n_results=k,
+                where=where_filter,
+                include=["documents", "metadatas", "distances"]
             )
             
-            # Format results into a list of dictionaries
-            formatted_results = []
-            for doc, score in results:
-                formatted_results.append({
-                    "source": "knowledge_base",
-                    "content": doc.page_content,
-                    "metadata": doc.metadata,
-                    "score": score
-                })
-            return formatted_results
+            # Format each query's results into a list of dictionaries
+            return [
+                [
+                    {
+                        "id": doc_id,
+                        "source": "knowledge_base",
+                        "content": content,
+                        "metadata": metadata,
+                        "score": distance
+                    }
+                    for doc_id, content, metadata, distance in zip(ids, documents, metadatas, distances)
+                ]
+                for ids, documents, metadatas, distances in zip(
+                    results["ids"], results["documents"], results["metadatas"], results["distances"]
+                )
+            ]
 
         except Exception as e:
-            print(f"Search error: {e}")
-            return []
+            logger.error("Search error: %s", e)
+            return [[] for _ in queries]
+
+    def _perform_search(self, query: str, agent_type: str = None, k: int = 5, embedding: Optional[List[float]] = None):
+        """Internal method to perform a single search with filtering.
+
+        Results are kept in an LRU keyed by (query, agent_type, k), so repeated searches skip the store.
+        """
+        cache_key = (query, agent_type, k)
+        with self._search_cache_lock:
+            cached = self._search_cache.get(cache_key)
+            if cached is not None:
+                self._search_cache.move_to_end(cache_key)
+                return list(cached)
 
-    def search(self, query: str, agent_type: str = None, k: int = 5):
+        results = self._perform_search_batch([query], agent_type, k, None if embedding is None else [embedding])[0]
+        if results:
+            with self._search_cache_lock:
+                self._search_cache[cache_key] = results
+                if len(self._search_cache) > SEARCH_CACHE_SIZE:
+                    self._search_cache.popitem(last=False)
+        return list(results)
+
+    def search(self, query: str, agent_type: str = None, k: int = 5, embedding: Optional[List[float]] = None):
         """Synchronous search method."""
-        return self._perform_search(query, agent_type, k)
+        return self._perform_search(query, agent_type, k, embedding)
 
-    async def asearch(self, query: str, agent_type: str = None, k: int = 5):
+    async def asearch(self, query: str, agent_type: str = None, k: int = 5, embedding: Optional[List[float]] = None):
         """Async wrapper for the search method."""
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(
-            None, lambda: self._perform_search(query, agent_type, k)
-        )
+        return await asyncio.to_thread(self._perform_search, query, agent_type, k, embedding)
     
     def test_searches(self):
         """Test search functionality for different agent types."""
@@ -3,15 +3,18 @@ Database setup script for the cybersecurity knowledge base.
 This script initializes and populates the vector database with cybersecurity documents.
 """
 
+import argparse
 from db.vector_store import DatabaseManager
 
-def setup_and_test_database(persist_directory: str = None):
+def setup_and_test_database(persist_directory: str = None, use_cache: bool = True, urlhaus_max_rows: int = None):
     """
     Main function to setup and test the cybersecurity knowledge database.
     
     Args:
         persist_directory (str, optional): Directory to store the Chroma database.
             If None, uses default path from DatabaseManager.
+        use_cache (bool): Reuse processed documents of unchanged source files from earlier runs.
+        urlhaus_max_rows (int, optional): Ingest at most this many URLHaus rows. If None, ingests the whole feed.
         
     Returns:
         DatabaseManager: Initialized database manager instance
@@ -22,7 +25,7 @@ def setup_and_test_database(persist_directory: str = None):
     db_manager = DatabaseManager(persist_directory)
     
     # Setup and populate the database
-    if db_manager.setup_database():
+    if db_manager.setup_database(use_cache=use_cache, urlhaus_max_rows=urlhaus_max_rows):
         print("\n=== Database Setup Complete ===")
         
         # Test the search functionality
@@ -36,7 +39,14 @@ def setup_and_test_database(persist_directory: str = None):
 
 def main():
     """Main execution function."""
-    db_manager = setup_and_test_database()
+    parser = argparse.ArgumentParser(description="Set up the cybersecurity knowledge database.")
+    parser.add_argument("--ignore-cache", action="store_true",
+                        help="Re-process every source document instead of reusing cached results")
+    parser.add_argument("--urlhaus-max-rows", type=int, default=None,
+                        help="Ingest only the first N URLHaus rows (e.g. 5000 for a quick test build)")
+    args = parser.parse_args()
+
+    db_manager = setup_and_test_database(use_cache=not args.ignore_cache, urlhaus_max_rows=args.urlhaus_max_rows)
     
     if db_manager:
         print("\nDatabase is ready for use!")
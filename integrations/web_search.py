@@ -1,12 +1,68 @@
 from langchain_tavily import TavilySearch
-from typing import Optional, List, Dict # Make sure List and Dict are imported
+from typing import Awaitable, Callable, Optional, List, Dict, Tuple # Make sure List and Dict are imported
+from bisect import bisect_left
+from collections import OrderedDict
+from types import MappingProxyType
+from itertools import accumulate
+from urllib.parse import urlsplit
 from dotenv import load_dotenv
+import asyncio
+import numpy as np
 import os
+import logging
+import re
+import time
+
+from utils.tokens import count_tokens
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Number of past searches kept for reuse, how long (seconds) their results stay fresh, and the cosine
+# similarity at which a new query counts as a repeat of a cached one.
+SEARCH_CACHE_SIZE = 256
+SEARCH_CACHE_TTL = 3600
+SEARCH_CACHE_SIMILARITY = 0.97
+# Cached results younger than this (seconds) are served as is; older ones are still served until
+# SEARCH_CACHE_TTL, but trigger a background refresh so the next hit sees current results.
+SEARCH_CACHE_FRESH = 900
+# Upper bound on Tavily requests in flight at once, shared by every caller of this client.
+MAX_CONCURRENT_SEARCHES = 5
+# Page text kept per result. Agents put at most a 4000-token web context in the prompt, so longer pages
+# (often 50KB+) would only be tokenized and cached to be cut off again.
+RAW_CONTENT_MAX_CHARS = 20000
+
+_SECURITY_KEYWORDS = [
+    "vulnerability", "exploit", "malware", "cybersecurity", "threat",
+    "incident", "breach", "attack", "security", "CVE", "IOC",
+    "ransomware", "phishing", "firewall", "encryption", "authentication",
+    "penetration", "pentest", "red team", "blue team", "soc", "siem"
+]
+# One case-insensitive scan for all keywords. Keywords must start a word, so "attacks" still matches but
+# "soc" no longer fires inside words like "associate".
+_SECURITY_QUERY_RE = re.compile(r"\b(?:" + "|".join(map(re.escape, _SECURITY_KEYWORDS)) + ")", re.IGNORECASE)
+
+# Identifiers a query must share exactly with a cached query before a semantic match counts: CVE ids, IPv4
+# addresses, MD5/SHA-1/SHA-256 hashes and years. Embeddings barely tell "CVE-2024-3094" from "CVE-2024-3400".
+_QUERY_IDENTIFIER_RE = re.compile(
+    r"\bCVE-\d{4}-\d{4,}\b"
+    r"|\b(?:\d{1,3}\.){3}\d{1,3}\b"
+    r"|\b(?:[0-9a-f]{64}|[0-9a-f]{40}|[0-9a-f]{32})\b"
+    r"|\b(?:19|20)\d{2}\b",
+    re.IGNORECASE
+)
+
+def _query_identifiers(query: str) -> frozenset:
+    """Return the identifiers in query, case-normalized."""
+    return frozenset(match.upper() for match in _QUERY_IDENTIFIER_RE.findall(query))
+
+# Parameters shared by every Tavily request; only the query varies per call.
+_BASE_SEARCH_PARAMS = MappingProxyType({"search_depth": "advanced"})
+
 class TavilyWebSearch:
-    def __init__(self):
+    def __init__(self, embed_query: Optional[Callable[[str], Awaitable[List[float]]]] = None):
+        """embed_query, if given, embeds queries (normalized) so near-duplicate searches reuse cached results."""
         self.tavily_api_key = os.getenv("TAVILY_API_KEY")
         if not self.tavily_api_key:
             raise ValueError("TAVILY_API_KEY environment variable is not set.")
@@ -24,79 +80,158 @@ class TavilyWebSearch:
             "nvd.nist.gov", "attack.mitre.org", "schneier.com",
             "krebsonsecurity.com"
         ]
-        
-    # web_search.py
 
-# ... (imports and class definition are the same)
+        # A host is trusted if it is a trusted domain or one of its subdomains: one set lookup plus one
+        # C-level endswith over all suffixes, instead of a substring scan of the URL per domain.
+        self._trusted_hosts = frozenset(self.trusted_domains)
+        self._trusted_suffixes = tuple(f".{domain}" for domain in self.trusted_domains)
 
-    # web_search.py -> The final, corrected search method
+        self._embed_query = embed_query
+        self._search_slots = asyncio.Semaphore(MAX_CONCURRENT_SEARCHES)
+        # query -> (embedding or None, insertion time, results), least recently used first
+        self._cache: "OrderedDict[str, Tuple[Optional[np.ndarray], float, List[Dict]]]" = OrderedDict()
+        # Background refreshes in flight, by cache key; one at a time per key
+        self._refresh_tasks: Dict[str, asyncio.Task] = {}
 
-    async def search(self, query: str, agent_type: Optional[str] = None) -> List[Dict]:
-        """Search the web using Tavily and return a list of structured results."""
+    def _is_trusted_url(self, url: str) -> bool:
+        """Check whether the URL's host is a trusted domain or a subdomain of one."""
+        host = (urlsplit(url).hostname or "") if url else ""
+        return host in self._trusted_hosts or host.endswith(self._trusted_suffixes)
+
+    async def _cache_lookup(self, query: str) -> Tuple[Optional[str], Optional[np.ndarray]]:
+        """Return (key of the matching cache entry or None, query embedding or None).
+
+        An exact query match is checked first; otherwise the most similar fresh entry with the same identifiers
+        (see _query_identifiers) is used if it clears SEARCH_CACHE_SIMILARITY. The embedding is returned so a
+        miss can be stored without re-embedding.
+        """
+        now = time.monotonic()
+        for key in [key for key, (_, added, _) in self._cache.items() if now - added > SEARCH_CACHE_TTL]:
+            del self._cache[key]
+
+        entry = self._cache.get(query)
+        if entry is not None:
+            self._cache.move_to_end(query)
+            return query, entry[0]
+
+        if self._embed_query is None:
+            return None, None
         try:
-            search_params = {"query": query, "search_depth": "advanced"}
-            
-            # This returns a dictionary, e.g., {'query': ..., 'results': [...]}
+            embedding = np.asarray(await self._embed_query(query), dtype=np.float32)
+        except Exception:
+            logger.warning("Could not embed web search query for the cache", exc_info=True)
+            return None, None
+
+        identifiers = _query_identifiers(query)
+        keys = [
+            key for key, (cached_embedding, _, _) in self._cache.items()
+            if cached_embedding is not None and _query_identifiers(key) == identifiers
+        ]
+        if keys:
+            # Embeddings are normalized, so one matmul gives the cosine similarity to every cached query.
+            similarities = np.stack([self._cache[key][0] for key in keys]) @ embedding
+            best = int(np.argmax(similarities))
+            if similarities[best] >= SEARCH_CACHE_SIMILARITY:
+                logger.debug("Web search cache hit: %r ~ %r (%.3f)", query, keys[best], similarities[best])
+                self._cache.move_to_end(keys[best])
+                return keys[best], embedding
+        return None, embedding
+
+    def _cache_store(self, query: str, embedding: Optional[np.ndarray], results: List[Dict]):
+        """Cache results under query, evicting the least recently used entry if the cache is full."""
+        self._cache[query] = (embedding, time.monotonic(), results)
+        self._cache.move_to_end(query)
+        if len(self._cache) > SEARCH_CACHE_SIZE:
+            self._cache.popitem(last=False)
+
+    async def _fetch(self, query: str) -> List[Dict]:
+        """Query Tavily and return its results annotated and ordered, trusted sources first."""
+        search_params = {**_BASE_SEARCH_PARAMS, "query": query}
+        
+        # This returns a dictionary, e.g., {'query': ..., 'results': [...]}
+        async with self._search_slots:
             response_dict = await self.search_tool.ainvoke(search_params)
-            
-            # --- START OF THE FINAL FIX ---
-            # Extract the list of documents from the 'results' key.
-            search_documents = response_dict.get('results', [])
-            # --- END OF THE FINAL FIX ---
-
-            if not search_documents:
-                return []
-            
-            # Now, process the 'search_documents' list as intended.
-            processed_results = []
-            for result in search_documents:
-                if isinstance(result, dict):
-                    is_trusted = any(domain in result.get('url', '') for domain in self.trusted_domains)
-                    result['is_trusted'] = is_trusted
-                    result['source'] = 'web_search'
-                    processed_results.append(result)
-            
-            processed_results.sort(key=lambda r: r.get('is_trusted', False), reverse=True)
-            
-            return processed_results
-            
+        
+        # Extract the list of documents from the 'results' key.
+        search_documents = response_dict.get('results', [])
+        
+        # Trusted results go first; partitioning keeps Tavily's ranking within each group, like a stable sort.
+        trusted_results, other_results = [], []
+        for result in search_documents:
+            if isinstance(result, dict):
+                if isinstance(result.get('raw_content'), str):
+                    result['raw_content'] = result['raw_content'][:RAW_CONTENT_MAX_CHARS]
+                result['is_trusted'] = self._is_trusted_url(result.get('url', ''))
+                result['source'] = 'web_search'
+                (trusted_results if result['is_trusted'] else other_results).append(result)
+        return trusted_results + other_results
+
+    async def _refresh(self, query: str):
+        """Re-run a cached search in the background and replace its entry; on failure the old entry stays."""
+        try:
+            results = await self._fetch(query)
+            entry = self._cache.get(query)
+            if results and entry is not None:
+                self._cache_store(query, entry[0], results)
+        except Exception:
+            logger.warning("Background refresh of web search %r failed", query, exc_info=True)
+        finally:
+            self._refresh_tasks.pop(query, None)
+
+    async def search(self, query: str, agent_type: Optional[str] = None) -> List[Dict]:
+        """Search the web using Tavily and return a list of structured results.
+
+        Results for the same or a near-duplicate query are served from an in-memory cache for SEARCH_CACHE_TTL;
+        past SEARCH_CACHE_FRESH the cached results are still returned while a background search refreshes them.
+        """
+        cache_key, embedding = await self._cache_lookup(query)
+        if cache_key is not None:
+            _, added, cached_results = self._cache[cache_key]
+            if time.monotonic() - added > SEARCH_CACHE_FRESH and cache_key not in self._refresh_tasks:
+                self._refresh_tasks[cache_key] = asyncio.create_task(self._refresh(cache_key))
+            return [dict(result) for result in cached_results]
+
+        try:
+            processed_results = await self._fetch(query)
         except Exception as e:
-            import traceback
-            print(f"CRITICAL ERROR during Tavily search: {e}\n{traceback.format_exc()}")
+            logger.exception("Error during Tavily search")
             return []
 
+        if processed_results:
+            self._cache_store(query, embedding, processed_results)
+        return [dict(result) for result in processed_results]
+
+    async def search_many(self, queries: List[Tuple[str, Optional[str]]]) -> List[List[Dict]]:
+        """Run several (query, agent_type) searches concurrently; results are returned in input order.
+
+        A failed search yields an empty list instead of cancelling the others.
+        """
+        results = await asyncio.gather(
+            *(self.search(query, agent_type) for query, agent_type in queries),
+            return_exceptions=True
+        )
+        for (query, _), result in zip(queries, results):
+            if isinstance(result, Exception):
+                logger.error("Web search for %r failed: %s", query, result)
+        return [[] if isinstance(result, Exception) else result for result in results]
+
     def _is_security_query(self, query: str) -> bool:
         """Check if query is security-related."""
-        security_keywords = [
-            "vulnerability", "exploit", "malware", "cybersecurity", "threat",
-            "incident", "breach", "attack", "security", "CVE", "IOC",
-            "ransomware", "phishing", "firewall", "encryption", "authentication",
-            "penetration", "pentest", "red team", "blue team", "soc", "siem"
-        ]
-        return any(keyword in query.lower() for keyword in security_keywords)
+        return _SECURITY_QUERY_RE.search(query) is not None
         
     def _trim_messages(self, messages: list, max_tokens: int = 100000) -> list:
-        """Trim messages to stay within token limits."""
-        total_chars = sum(len(str(msg.content)) for msg in messages)
-        estimated_tokens = total_chars // 4
+        """Trim messages to stay within token limits, keeping the first message and the most recent ones."""
+        token_counts = [count_tokens(str(msg.content)) for msg in messages]
         
-        if estimated_tokens <= max_tokens:
+        if sum(token_counts) <= max_tokens:
             return messages
         
         if len(messages) <= 2:
             return messages
         
-        trimmed = [messages[0]]
-        
-        recent_chars = 0
-        target_chars = max_tokens * 4 * 0.8
-        
-        for msg in reversed(messages[1:]):
-            msg_chars = len(str(msg.content))
-            if recent_chars + msg_chars < target_chars:
-                recent_chars += msg_chars
-                trimmed.insert(1, msg)
-            else:
-                break
+        # recent_tokens[j] is the size of the last j + 1 messages, so the number of recent messages
+        # that fit under the target is a single binary search.
+        recent_tokens = list(accumulate(reversed(token_counts[1:])))
+        keep = bisect_left(recent_tokens, max_tokens * 0.8)
         
-        return trimmed
\ No newline at end of file
+        return [messages[0]] + messages[len(messages) - keep:] if keep else [messages[0]]
\ No newline at end of file
@@ -1,16 +1,18 @@
 import asyncio
-import uuid
 import traceback
-import json
-from datetime import datetime
+from collections import OrderedDict
+import orjson
 from fastapi import FastAPI, WebSocket, Request, WebSocketDisconnect
+from fastapi.responses import HTMLResponse, ORJSONResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 from pathlib import Path
 
 from agents.workflow import CybersecurityRAGWorkflow
+from utils.logger import setup_logging, shutdown_logging
+from utils.ids import new_session_id
 
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 
 # Mount static files
 static_path = Path(__file__).parent / "static"
@@ -20,6 +22,12 @@ app.mount("/static", StaticFiles(directory=static_path), name="static")
 templates_path = Path(__file__).parent / "templates"
 templates = Jinja2Templates(directory=templates_path)
 
+# Rendered index pages kept; url_for makes the page depend on the client-supplied host, so the cache is bounded
+INDEX_CACHE_SIZE = 8
+app_jsx_path = static_path / "app.jsx"
+# base URL -> (app.jsx mtime the page was rendered for, rendered page), least recently used first
+_index_cache: "OrderedDict[str, tuple[int, bytes]]" = OrderedDict()
+
 # Global workflow instance
 workflow = None
 
@@ -27,9 +35,11 @@ workflow = None
 async def startup_event():
     """Initialize the workflow on application startup."""
     global workflow
+    setup_logging()
     print("Initializing workflow...")
     workflow = CybersecurityRAGWorkflow()
     await workflow.initialize()
+    await workflow.warmup()
     print("Workflow initialized.")
 
 @app.on_event("shutdown")
@@ -39,17 +49,31 @@ async def shutdown_event():
         print("Closing workflow resources...")
         await workflow.close()
         print("Workflow closed.")
+    shutdown_logging()
 
 @app.get("/")
 async def get(request: Request):
     """Serve the main chat interface."""
-    return templates.TemplateResponse("index.html", {"request": request, "now": datetime.utcnow})
+    # The app.jsx mtime is the cache-buster, so a cached page stays valid until the script changes
+    asset_version = app_jsx_path.stat().st_mtime_ns
+    cache_key = str(request.base_url)
+    cached = _index_cache.get(cache_key)
+    if cached and cached[0] == asset_version:
+        _index_cache.move_to_end(cache_key)
+        return HTMLResponse(cached[1])
+
+    html = templates.get_template("index.html").render({"request": request, "asset_version": asset_version}).encode("utf-8")
+    _index_cache[cache_key] = (asset_version, html)
+    _index_cache.move_to_end(cache_key)
+    if len(_index_cache) > INDEX_CACHE_SIZE:
+        _index_cache.popitem(last=False)
+    return HTMLResponse(html)
 
 # This is a new endpoint to fetch history.
 @app.get("/chat_history/{session_id}")
 async def get_chat_history(session_id: str):
     if not workflow or not workflow.checkpointer:
-        return {"error": "Workflow not initialized"}, 404
+        return ORJSONResponse({"error": "Workflow not initialized"}, status_code=404)
     
     try:
         # Retrieve the conversation state from the checkpointer
@@ -63,30 +87,32 @@ async def get_chat_history(session_id: str):
             for msg in state.values.get("messages", []):
                 if hasattr(msg, 'type') and hasattr(msg, 'content'):
                      history.append({"type": msg.type, "content": msg.content})
-            return {"history": history}
+            return ORJSONResponse({"history": history})
         else:
-            return {"history": []}
+            return ORJSONResponse({"history": []})
             
     except Exception as e:
         print(f"Error fetching history for {session_id}: {e}")
-        return {"error": "Could not retrieve chat history"}, 500
+        return ORJSONResponse({"error": "Could not retrieve chat history"}, status_code=500)
+
+async def _forward_tokens(websocket: WebSocket, tokens: asyncio.Queue, session_id: str):
+    """Send queued answer tokens to the client as "token" frames, in order, until None is queued."""
+    while (token := await tokens.get()) is not None:
+        await websocket.send_bytes(orjson.dumps({"type": "token", "session_id": session_id, "data": token}))
 
 @app.websocket("/ws/chat")
 async def websocket_endpoint(websocket: WebSocket):
     """Handle WebSocket connections for the chat."""
     await websocket.accept()
     
-    active_connections: list[WebSocket] = []
-    active_connections.append(websocket)
-    
     print("New client connected.")
 
     try:
         while True:
-            # Wait for a message from the client (now expecting JSON)
-            data = await websocket.receive_json()
+            # Wait for a message from the client (UTF-8 JSON in a binary frame)
+            data = orjson.loads(await websocket.receive_bytes())
             user_query = data.get("query")
-            session_id = data.get("session_id") # Can be null for new chats
+            session_id = data.get("session_id") or new_session_id() # Null for new chats
             model_choice = data.get("model", "openai_mini")  # Default to openai_mini
             agent_choice = data.get("agent", "auto")  # Default to auto
 
@@ -96,44 +122,51 @@ async def websocket_endpoint(websocket: WebSocket):
             try:
                 # Create client config for the new API
                 client_config = {
-                    "configurable": {"thread_id": session_id or str(uuid.uuid4())},
+                    "configurable": {"thread_id": session_id},
                     "preferred_llm_choice": model_choice,
                     "preferred_agent": agent_choice if agent_choice != "auto" else None
                 }
                 
-                # Use the new process_query_async API
-                result = await workflow.process_query_async(user_query, client_config)
+                # Stream the answer as it is generated; the workflow's token callback is synchronous,
+                # so tokens go through a queue to a single sender task that keeps them in order.
+                tokens: asyncio.Queue = asyncio.Queue()
+                sender = asyncio.create_task(_forward_tokens(websocket, tokens, session_id))
+                try:
+                    result = await workflow.process_query_async(user_query, client_config, on_token=tokens.put_nowait)
+                finally:
+                    tokens.put_nowait(None)
+                    await sender
                 
                 # Add model and agent info to result
+                result["type"] = "done"
                 result["model_used"] = model_choice
                 result["agent_choice"] = agent_choice
                 
                 # Send the full result object as JSON
-                await websocket.send_json(result)
+                await websocket.send_bytes(orjson.dumps(result))
 
             except Exception as e:
                 error_message = f"Error processing query: {str(e)}"
                 print(error_message)
                 traceback.print_exc()
-                await websocket.send_json({
+                await websocket.send_bytes(orjson.dumps({
+                    "type": "error",
                     "response": f"Sorry, an error occurred: {e}", 
                     "agent_type": "Error", 
-                    "session_id": session_id or str(uuid.uuid4()), 
+                    "session_id": session_id, 
                     "model_used": model_choice, 
                     "agent_choice": agent_choice
-                })
+                }))
 
     except WebSocketDisconnect:
         print(f"Client disconnected.")
-        active_connections.remove(websocket)
     except Exception as e:
         print(f"An unexpected error occurred in WebSocket: {e}")
         traceback.print_exc()
-        if websocket in active_connections:
-            active_connections.remove(websocket)
 
 if __name__ == "__main__":
     import uvicorn
     # Note: Running this way is for development. 
     # For production, use a command like: uvicorn main:app --host 0.0.0.0 --port 8000
-    uvicorn.run(app, host="127.0.0.1", port=8001)
\ No newline at end of file
+    # "auto" picks uvloop where it is installed (not on Windows) and falls back to asyncio elsewhere.
+    uvicorn.run(app, host="127.0.0.1", port=8001, loop="auto", http="httptools", ws="websockets")
\ No newline at end of file
@@ -42,11 +42,14 @@ const App = () => {
 
   useEffect(() => {
     const ws = new WebSocket(`ws://${window.location.host}/ws/chat`);
+    ws.binaryType = "arraybuffer";
     setSocket(ws);
 
     ws.onopen = () => console.log("WebSocket connected");
     ws.onmessage = (event) => {
-      const data = JSON.parse(event.data);
+      const data = JSON.parse(new TextDecoder().decode(event.data));
+      // Only the final frame carries the whole answer; streamed tokens are not shown here.
+      if (data.type === "token") return;
       setIsThinking(false);
       setMessages((prev) => [...prev, { ...data, type: "ai" }]);
     };
@@ -60,7 +63,7 @@ const App = () => {
     e.preventDefault();
     if (query.trim() && socket && socket.readyState === WebSocket.OPEN) {
       setMessages((prev) => [...prev, { type: "user", content: query }]);
-      socket.send(JSON.stringify({ query, session_id: sessionId, model, agent }));
+      socket.send(new TextEncoder().encode(JSON.stringify({ query, session_id: sessionId, model, agent })));
       setQuery("");
       setIsThinking(true);
     }
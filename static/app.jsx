@@ -1,5 +1,9 @@
 const { useState, useEffect, useRef, StrictMode } = React;
 
+// The chat socket exchanges UTF-8 JSON in binary frames.
+const textEncoder = new TextEncoder();
+const textDecoder = new TextDecoder();
+
 const App = () => {
   // --- STATE MANAGEMENT ---
   const [chats, setChats] = useState({});
@@ -49,15 +53,34 @@ const App = () => {
     // Initialize WebSocket connection
     const wsProtocol = window.location.protocol === "https" ? "wss:" : "ws:";
     ws.current = new WebSocket(`${wsProtocol}//${window.location.host}/ws/chat`);
+    ws.current.binaryType = "arraybuffer";
 
     ws.current.onopen = () => console.log("WebSocket connected");
     ws.current.onclose = () => console.log("WebSocket disconnected");
     ws.current.onerror = (err) => console.error("WebSocket error:", err);
 
     ws.current.onmessage = (event) => {
-      const data = JSON.parse(event.data);
+      const data = JSON.parse(textDecoder.decode(event.data));
       const serverSessionId = data.session_id;
 
+      // Answer text arrives as "token" frames before the final "done" (or "error") frame.
+      if (data.type === "token") {
+        setChats((prevChats) => {
+          const chatId = prevChats[serverSessionId]
+            ? serverSessionId
+            : Object.keys(prevChats).find((id) => prevChats[id].isTyping);
+          if (!chatId) return prevChats;
+
+          const chat = prevChats[chatId];
+          const last = chat.history[chat.history.length - 1];
+          const history = last?.streaming
+            ? [...chat.history.slice(0, -1), { ...last, content: { response: last.content.response + data.data } }]
+            : [...chat.history, { type: "agent", streaming: true, content: { response: data.data } }];
+          return { ...prevChats, [chatId]: { ...chat, history } };
+        });
+        return;
+      }
+
       setChats((prevChats) => {
         const newChats = { ...prevChats };
         const provisionalId = Object.keys(newChats).find((id) => newChats[id].isTyping);
@@ -68,13 +91,16 @@ const App = () => {
 
           newChats[serverSessionId] = {
             ...provisionalChatData,
-            history: [...provisionalChatData.history, { type: "agent", content: data }],
+            history: [...provisionalChatData.history.filter((msg) => !msg.streaming), { type: "agent", content: data }],
             isTyping: false,
           };
         } else {
           newChats[serverSessionId] = {
             ...newChats[serverSessionId],
-            history: [...(newChats[serverSessionId]?.history || []), { type: "agent", content: data }],
+            history: [
+              ...(newChats[serverSessionId]?.history || []).filter((msg) => !msg.streaming),
+              { type: "agent", content: data },
+            ],
             isTyping: false,
           };
         }
@@ -126,12 +152,14 @@ const App = () => {
     }
 
     ws.current.send(
-      JSON.stringify({
-        query,
-        session_id: sessionIdToSend,
-        model: selectedModel,
-        agent: selectedAgent,
-      })
+      textEncoder.encode(
+        JSON.stringify({
+          query,
+          session_id: sessionIdToSend,
+          model: selectedModel,
+          agent: selectedAgent,
+        })
+      )
     );
   };
 
@@ -261,7 +289,7 @@ const ChatWindow = ({ chat, onSendMessage, selectedModel, onModelChange, selecte
       <Header />
       <main className="flex-1 overflow-y-auto p-6 space-y-6">
         {!chat ? <WelcomeMessage /> : chat.history.map((msg, index) => <Message key={index} message={msg} />)}
-        {chat?.isTyping && <TypingIndicator />}
+        {chat?.isTyping && !chat.history[chat.history.length - 1]?.streaming && <TypingIndicator />}
         <div ref={messagesEndRef} />
       </main>
       <InputArea
@@ -385,7 +413,7 @@ const InputArea = ({ onSendMessage, selectedModel, onModelChange, selectedAgent,
 const Message = ({ message }) => {
   const isUser = message.type === "user";
   const content = isUser ? message.content : message.content.response;
-  const agentData = isUser ? null : message.content;
+  const agentData = isUser || message.streaming ? null : message.content;
 
   const getModelDisplayName = (modelValue) => {
     const modelMap = {
@@ -1,74 +1,187 @@
 import asyncio
+import hashlib
 import json
+import logging
+import os
+import re
+import sys
+from collections import OrderedDict
+from types import MappingProxyType
 from agents.workflow import CybersecurityRAGWorkflow
+from integrations.web_search import TavilyWebSearch
 from langchain_core.messages import HumanMessage
+from utils.logger import setup_logging, shutdown_logging
+from utils.tokens import count_tokens
 
-async def test_web_search_integration():
-    """Test the web search integration with various queries."""
-    
-    workflow = CybersecurityRAGWorkflow(llm_choice="openai_mini")
-    await workflow.initialize()
-    
-    test_queries = [
-        {
-            "query": "What is the latest CVE-2024 vulnerability?",
-            "expected_behavior": "Cybersecurity query + needs web search for latest info",
-            "expected_cyber": True,
-            "expected_web_search": True,
-            "expected_kb_search": True
-        },
-        {
-            "query": "What is SQL injection?",
-            "expected_behavior": "Cybersecurity query but doesn't need web search (general concept)",
-            "expected_cyber": True,
-            "expected_web_search": False,
-            "expected_kb_search": True
-        },
-        {
-            "query": "What time is it in London?",
-            "expected_behavior": "Non-cyber query that needs web search",
-            "expected_cyber": False,
-            "expected_web_search": True,
-            "expected_kb_search": False
-        },
-        {
-            "query": "How do I make a paper airplane?",
-            "expected_behavior": "Non-cyber query that doesn't need web search",
-            "expected_cyber": False,
-            "expected_web_search": False,
-            "expected_kb_search": False
-        },
-        {
-            "query": "Recent ransomware attacks in 2024",
-            "expected_behavior": "Cybersecurity query needing current info",
-            "expected_cyber": True,
-            "expected_web_search": True,
-            "expected_kb_search": True
-        },
-        {
-            "query": "Explain the principle of least privilege",
-            "expected_behavior": "Cybersecurity concept that doesn't need current info",
-            "expected_cyber": True,
-            "expected_web_search": False,
-            "expected_kb_search": True
-        },
-        {
-            "query": "What's the current weather in New York?",
-            "expected_behavior": "Non-cyber query needing current info",
-            "expected_cyber": False,
-            "expected_web_search": True,
-            "expected_kb_search": False
-        },
-        {
-            "query": "Latest zero-day exploits",
-            "expected_behavior": "Cybersecurity query about recent threats",
-            "expected_cyber": True,
-            "expected_web_search": True,
-            "expected_kb_search": True
-        }
+logger = logging.getLogger(__name__)
+
+# Test queries run concurrently, this many at a time, each given at most this many seconds.
+TEST_CONCURRENCY = int(os.getenv("TEST_CONCURRENCY", "4"))
+TEST_QUERY_TIMEOUT = float(os.getenv("TEST_QUERY_TIMEOUT", "180"))
+
+WEB_INDICATORS = ["http", "www", "Source:", "Web Source:", "according to", "🔐"]
+# Lookahead so overlapping indicators ("Source:" inside "Web Source:") are each found in one pass.
+WEB_INDICATOR_RE = re.compile("(?=(" + "|".join(map(re.escape, WEB_INDICATORS)) + "))")
+CYBER_TERM_RE = re.compile("security|vulnerability|attack|threat|cyber|exploit", re.IGNORECASE)
+
+# Fields every inspected query starts with; the per-query messages, thread id and fresh mutable containers are added in the loop.
+_STATE_TEMPLATE = MappingProxyType({
+    "agent_type": None,
+    "confidence_score": 0.0,
+    "needs_routing": True,
+    "is_follow_up": False,
+    "preferred_agent": None,
+    "llm_choice": "openai_mini",
+    "collaboration_mode": "single_agent",
+    "needs_collaboration": False,
+    "primary_agent": None,
+    "collaboration_confidence": None,
+    "needs_web_search": False,
+    "conversation_summary": ""
+})
+
+# Queries run by test_web_search_integration with the behavior each should show; read-only so runs cannot alter them.
+TEST_QUERIES = tuple(MappingProxyType(test_case) for test_case in [
+    {
+        "query": "What is the latest CVE-2024 vulnerability?",
+        "expected_behavior": "Cybersecurity query + needs web search for latest info",
+        "expected_cyber": True,
+        "expected_web_search": True,
+        "expected_kb_search": True
+    },
+    {
+        "query": "What is SQL injection?",
+        "expected_behavior": "Cybersecurity query but doesn't need web search (general concept)",
+        "expected_cyber": True,
+        "expected_web_search": False,
+        "expected_kb_search": True
+    },
+    {
+        "query": "What time is it in London?",
+        "expected_behavior": "Non-cyber query that needs web search",
+        "expected_cyber": False,
+        "expected_web_search": True,
+        "expected_kb_search": False
+    },
+    {
+        "query": "How do I make a paper airplane?",
+        "expected_behavior": "Non-cyber query that doesn't need web search",
+        "expected_cyber": False,
+        "expected_web_search": False,
+        "expected_kb_search": False
+    },
+    {
+        "query": "Recent ransomware attacks in 2024",
+        "expected_behavior": "Cybersecurity query needing current info",
+        "expected_cyber": True,
+        "expected_web_search": True,
+        "expected_kb_search": True
+    },
+    {
+        "query": "Explain the principle of least privilege",
+        "expected_behavior": "Cybersecurity concept that doesn't need current info",
+        "expected_cyber": True,
+        "expected_web_search": False,
+        "expected_kb_search": True
+    },
+    {
+        "query": "What's the current weather in New York?",
+        "expected_behavior": "Non-cyber query needing current info",
+        "expected_cyber": False,
+        "expected_web_search": True,
+        "expected_kb_search": False
+    },
+    {
+        "query": "Latest zero-day exploits",
+        "expected_behavior": "Cybersecurity query about recent threats",
+        "expected_cyber": True,
+        "expected_web_search": True,
+        "expected_kb_search": True
+    }
+])
+
+_workflow = None
+
+async def get_workflow() -> CybersecurityRAGWorkflow:
+    """Create, initialize and warm up the workflow once; every test run in the same event loop shares it.
+
+    Warming up loads the vector store and embedding model and opens the LLM connections before the first
+    query, so that cold-start cost is not attributed to whichever test query happens to run first.
+    """
+    global _workflow
+    if _workflow is None:
+        _workflow = CybersecurityRAGWorkflow(llm_choice="openai_mini")
+        await _workflow.initialize()
+        await _workflow.warmup()
+    return _workflow
+
+async def close_workflow():
+    """Close the shared workflow, if one was created."""
+    global _workflow
+    if _workflow is not None:
+        await _workflow.close()
+        _workflow = None
+
+def test_special_token_text() -> int:
+    """Check that text containing a special-token string is counted rather than rejected. Returns 1 on failure."""
+    try:
+        passed = count_tokens("<|endoftext|>") > 0
+    except ValueError:
+        passed = False
+    print(f"Counting special-token text: {'✓ PASS' if passed else '✗ FAIL'}")
+    return 0 if passed else 1
+
+async def test_search_cache_identifiers() -> int:
+    """Check that near-identical queries about different CVEs miss the web search cache. Returns 1 on failure.
+
+    The fake embedding maps every query to the same vector, so only the identifier check can tell them apart.
+    No Tavily request is made, so the search client is built without __init__.
+    """
+    async def embed_query(query: str):
+        return [1.0, 0.0]
+
+    web_search = TavilyWebSearch.__new__(TavilyWebSearch)
+    web_search._embed_query = embed_query
+    web_search._cache = OrderedDict()
+
+    cached_query = "What is CVE-2024-3094 and how is it exploited?"
+    _, embedding = await web_search._cache_lookup(cached_query)
+    web_search._cache_store(cached_query, embedding, [{"url": "https://nvd.nist.gov/vuln/detail/CVE-2024-3094"}])
+
+    checks = [
+        ("what is CVE-2024-3094 and how is it exploited", cached_query),
+        ("What is CVE-2024-3400 and how is it exploited?", None),
     ]
+    failures = 0
+    for query, expected_key in checks:
+        key, _ = await web_search._cache_lookup(query)
+        passed = key == expected_key
+        failures += not passed
+        print(f"Cache lookup {query!r}: {'hit' if key else 'miss'} {'✓ PASS' if passed else '✗ FAIL'}")
+    return 1 if failures else 0
+
+async def test_web_search_integration() -> int:
+    """Test the web search integration with various queries. Returns the number of queries that failed or mismatched."""
     
-    for test_case in test_queries:
+    workflow = await get_workflow()
+    failures = 0
+    
+    # The queries are independent sessions, so run them together; the semaphore keeps API rate limits in check.
+    slots = asyncio.Semaphore(TEST_CONCURRENCY)
+
+    async def run_query(query: str):
+        async with slots:
+            return await asyncio.wait_for(
+                workflow.process_query_async(query, client_config={"preferred_llm_choice": "openai_mini"}),
+                timeout=TEST_QUERY_TIMEOUT
+            )
+
+    results = await asyncio.gather(
+        *(run_query(test_case['query']) for test_case in TEST_QUERIES),
+        return_exceptions=True
+    )
+
+    for test_case, result in zip(TEST_QUERIES, results):
         print("\n" + "="*80)
         print(f"Testing Query: {test_case['query']}")
         print(f"Expected Behavior: {test_case['expected_behavior']}")
@@ -76,10 +189,8 @@ async def test_web_search_integration():
         print("="*80)
         
         try:
-            result = await workflow.process_query_async(
-                test_case['query'],
-                client_config={"preferred_llm_choice": "openai_mini"}
-            )
+            if isinstance(result, Exception):
+                raise result
             
             print("\n--- RESULTS ---")
             print(f"Agent Type: {result.get('agent_type')}")
@@ -89,13 +200,12 @@ async def test_web_search_integration():
             print("\n--- ANALYSIS ---")
             
             response_text = result.get('response', '')
-            web_indicators = ["http", "www", "Source:", "Web Source:", "according to", "🔐"]
-            kb_indicators = ["knowledge base", "based on established", "according to best practices"]
+            web_indicators_found = set(WEB_INDICATOR_RE.findall(response_text))
             
-            web_search_used = any(indicator in response_text for indicator in web_indicators)
-            kb_search_likely = result.get('num_docs_retrieved', 0) > 0 and not all(indicator in response_text for indicator in web_indicators)
+            web_search_used = bool(web_indicators_found)
+            kb_search_likely = result.get('num_docs_retrieved', 0) > 0 and len(web_indicators_found) < len(WEB_INDICATORS)
             
-            is_cyber_response = any(term in response_text.lower() for term in ["security", "vulnerability", "attack", "threat", "cyber", "exploit"])
+            is_cyber_response = CYBER_TERM_RE.search(response_text) is not None
             
             print(f"Appears to be cyber-related response: {is_cyber_response}")
             print(f"Web search indicators found: {web_search_used}")
@@ -109,23 +219,23 @@ async def test_web_search_integration():
             print(f"Web search usage: {'✓ PASS' if web_match else '✗ FAIL'}")
             
             if not cyber_match or not web_match:
+                failures += 1
                 print("\n⚠️  WARNING: Behavior doesn't match expectations!")
             
             response_snippet = response_text[:300]
             print(f"\nResponse Snippet:\n{response_snippet}...")
             
         except Exception as e:
+            failures += 1
             print(f"\nERROR: {str(e)}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("Query failed: %s", test_case['query'])
     
-    await workflow.close()
-    print("\n\nDebug test completed!")
+    print(f"\n\nDebug test completed! {len(TEST_QUERIES) - failures}/{len(TEST_QUERIES)} queries behaved as expected.")
+    return failures
 
 async def inspect_state_details():
     """Deep inspection of state to see how the query flows through the system."""
-    workflow = CybersecurityRAGWorkflow(llm_choice="openai_mini")
-    await workflow.initialize()
+    workflow = await get_workflow()
     
     test_queries = [
         "What are the latest cybersecurity threats in 2024?",
@@ -139,24 +249,14 @@ async def inspect_state_details():
         print("="*80)
         
         initial_state = {
+            **_STATE_TEMPLATE,
             "messages": [HumanMessage(content=query)],
-            "agent_type": None,
-            "retrieved_docs": [],
-            "confidence_score": 0.0,
-            "needs_routing": True,
-            "thread_id": f"debug-thread-{query[:20]}",
-            "is_follow_up": False,
-            "preferred_agent": None,
-            "llm_choice": "openai_mini",
-            "collaboration_mode": "single_agent",
+            # Hash of the full query: stable across runs, and queries sharing a 20-character prefix no longer collide
+            "thread_id": f"debug-thread-{hashlib.blake2b(query.encode('utf-8'), digest_size=8).hexdigest()}",
+            "retrieved_doc_ids": [],
             "consulting_agents": [],
             "agent_responses": {},
-            "needs_collaboration": False,
-            "primary_agent": None,
-            "collaboration_confidence": None,
-            "thought_process": [],
-            "needs_web_search": False,
-            "conversation_summary": ""
+            "thought_process": []
         }
         
         config = {
@@ -164,35 +264,58 @@ async def inspect_state_details():
             "preferred_llm_choice": "openai_mini"
         }
         
-        await workflow.app.ainvoke(initial_state, config=config)
-        
-        final_state = await workflow.app.aget_state(config)
-        state_values = final_state.values
-        
+        # Stream the state after each step so thoughts print as the graph produces them; the last value is the final state.
         print("\n--- THOUGHT PROCESS ---")
-        for thought in state_values.get("thought_process", []):
-            print(f"  • {thought}")
+        state_values = initial_state
+        printed_thoughts = 0
+        async for state_values in workflow.app.astream(initial_state, config=config, stream_mode="values"):
+            thoughts = state_values.get("thought_process", [])
+            for thought in thoughts[printed_thoughts:]:
+                print(f"  • {thought}")
+            printed_thoughts = len(thoughts)
         
         print("\n--- RETRIEVED DOCUMENTS ---")
-        web_docs = [d for d in state_values.get("retrieved_docs", []) if d.get("source") == "web_search"]
-        kb_docs = [d for d in state_values.get("retrieved_docs", []) if d.get("source") != "web_search"]
+        web_docs, kb_docs = [], []
+        for doc_id in state_values.get("retrieved_doc_ids", []):
+            # Ids are "web:<url>" or "kb:<id>"; one split partitions them
+            source, _, ref = doc_id.partition(":")
+            if source == "web":
+                web_docs.append(ref)
+            elif source == "kb":
+                kb_docs.append(ref)
         
         print(f"Web Search Documents: {len(web_docs)}")
         print(f"Knowledge Base Documents: {len(kb_docs)}")
         
         if web_docs:
             print("\nWeb Sources:")
-            for doc in web_docs[:3]:
-                print(f"  - {doc.get('title', 'No title')} ({doc.get('url', 'No URL')})")
+            for url in web_docs[:3]:
+                print(f"  - {url}")
                 
         if kb_docs:
             print("\nKB Sources:")
-            for doc in kb_docs[:3]:
-                print(f"  - {doc.get('content', 'No content')[:100]}...")
-    
-    await workflow.close()
+            for doc_id in kb_docs[:3]:
+                print(f"  - {doc_id}")
+
+async def main() -> int:
+    """Run the checks against one shared workflow, so models, the vector store, and checkpointer load once.
+
+    Returns the process exit status: 1 if any query failed or did not behave as expected.
+    """
+    try:
+        failures = test_special_token_text()
+        failures += await test_search_cache_identifiers()
+        failures += await test_web_search_integration()
+        # await inspect_state_details()
+    finally:
+        await close_workflow()
+    return 1 if failures else 0
 
 if __name__ == "__main__":
+    setup_logging(logging.WARNING)
     print("Starting Web Search Integration Tests...")
-    asyncio.run(test_web_search_integration())
-    # asyncio.run(inspect_state_details())
\ No newline at end of file
+    try:
+        exit_status = asyncio.run(main())
+    finally:
+        shutdown_logging()
+    sys.exit(exit_status)
\ No newline at end of file
@@ -0,0 +1,24 @@
+import os
+import time
+import uuid
+
+
+def uuid7() -> uuid.UUID:
+    """Return an RFC 9562 version 7 UUID: a 48-bit millisecond timestamp followed by random bits.
+
+    Time-ordered ids keep checkpoint rows of recent threads close together in the SQLite index.
+    """
+    timestamp_ms = time.time_ns() // 1_000_000
+    rand = int.from_bytes(os.urandom(10), "big")
+
+    value = (timestamp_ms & 0xFFFF_FFFF_FFFF) << 80
+    value |= 0x7 << 76  # version
+    value |= ((rand >> 68) & 0xFFF) << 64  # rand_a
+    value |= 0b10 << 62  # variant
+    value |= rand & ((1 << 62) - 1)  # rand_b
+    return uuid.UUID(int=value)
+
+
+def new_session_id() -> str:
+    """Generate a new conversation / thread id."""
+    return str(uuid7())
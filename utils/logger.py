@@ -0,0 +1,38 @@
+import logging
+import logging.handlers
+import queue
+from typing import Optional
+
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def setup_logging(level: int = logging.INFO) -> None:
+    """Route all log records through a queue so request handlers never block on console I/O.
+
+    Records are enqueued by the caller and written to stderr by a background QueueListener thread.
+    Calling this more than once is a no-op.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    log_queue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    root_logger = logging.getLogger()
+    root_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    root_logger.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown_logging() -> None:
+    """Flush queued records and stop the background listener."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
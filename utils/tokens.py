@@ -0,0 +1,20 @@
+import tiktoken
+
+# Loaded once at import; building the BPE tables is the expensive part.
+_ENCODING = tiktoken.encoding_for_model("gpt-4o-mini")
+
+
+def count_tokens(text: str) -> int:
+    """Return the number of gpt-4o-mini tokens in text.
+
+    Special-token strings such as "<|endoftext|>" are counted as plain text; queries and scraped pages may contain them.
+    """
+    return len(_ENCODING.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text down to at most max_tokens tokens, leaving shorter text untouched."""
+    tokens = _ENCODING.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return _ENCODING.decode(tokens[:max_tokens])